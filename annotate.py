@@ -0,0 +1,216 @@
+"""
+Офлайн-разметка корпуса фраз той же логикой, что и /nlp/batch (server.process_batch).
+
+Корпус читается потоком (CSV или JSONL) и режется на батчи. Модель, spaCy и pymorphy2
+загружаются один раз в мастер-процессе, воркеры форкаются и делят их через
+copy-on-write, как в serve.py. В работе одновременно не больше --window батчей,
+поэтому память не растёт с размером корпуса.
+
+  python annotate.py --input logs.jsonl --output annotated.jsonl --workers 4
+  python annotate.py --input logs.csv --output annotated.jsonl --unordered --keep id ts
+  python annotate.py --input logs.jsonl --output annotated.jsonl --resume
+
+Каждая строка результата — ответ /nlp плюс "line" (номер записи во входе, с нуля)
+и поля из --keep. В режиме по умолчанию строки пишутся в порядке входа, с
+--unordered — по готовности батчей. --resume пропускает уже записанные номера
+и дописывает остальные; оборванная последняя строка отбрасывается.
+"""
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+
+def read_records(path, text_field, fmt):
+    """(номер, текст, исходная запись) для каждой записи входа"""
+    if fmt == "auto":
+        fmt = "csv" if path.endswith(".csv") else "jsonl"
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for n, row in enumerate(csv.DictReader(f)):
+                yield n, row.get(text_field), row
+            return
+        for n, line in enumerate(f):
+            if not line.strip():
+                yield n, "", {}
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                yield n, record, {}
+            else:
+                yield n, record.get(text_field), record
+
+
+def completed_lines(path):
+    """
+    Номера записей, уже записанных в path: все номера меньше prefix плюс
+    разреженный хвост. Оборванная последняя строка обрезается.
+    """
+    prefix, tail = 0, set()
+    if not os.path.exists(path):
+        return prefix, tail
+    good = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                n = json.loads(line)["line"]
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+            tail.add(n)
+            while prefix in tail:
+                tail.remove(prefix)
+                prefix += 1
+    if good != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good)
+    return prefix, tail
+
+
+def make_batches(records, size, done, keep):
+    prefix, tail = done
+    batch = []
+    for n, text, record in records:
+        if n < prefix or n in tail:
+            continue
+        batch.append((n, text, {k: record.get(k) for k in keep}))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def annotate_batch(batch, now):
+    """Готовые JSONL-строки для батча; сериализация тоже в воркере"""
+    import server
+
+    results = server.process_batch([text for _, text, _ in batch], now)
+    lines = []
+    for (n, _, extra), result in zip(batch, results):
+        lines.append(json.dumps({"line": n, **extra, **result}, ensure_ascii=False, default=str))
+    return len(lines), "\n".join(lines) + "\n"
+
+
+def init_worker(threads):
+    # Ctrl-C обрабатывает мастер: он дописывает готовое и завершает пул
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+class Progress:
+    def __init__(self, start_count, interval=5.0):
+        self.count = 0
+        self.start_count = start_count
+        self.interval = interval
+        self.started = self.last = time.perf_counter()
+
+    def add(self, n, force=False):
+        self.count += n
+        now = time.perf_counter()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            rate = self.count / max(now - self.started, 1e-9)
+            print(f"Размечено {self.start_count + self.count} ({rate:.0f} текстов/с)", file=sys.stderr)
+
+
+def run(args):
+    # До импорта torch/onnxruntime, чтобы пулы потоков не создавались на все ядра
+    os.environ["INFERENCE_THREADS"] = str(args.threads)
+    os.environ.setdefault("OMP_NUM_THREADS", str(args.threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(args.threads))
+
+    import server
+    from nlp_pipeline import preload
+
+    preload()
+    now = datetime.fromisoformat(args.now) if args.now else datetime.now()
+
+    done = completed_lines(args.output) if args.resume else (0, set())
+    progress = Progress(done[0] + len(done[1]))
+    batches = make_batches(read_records(args.input, args.text_field, args.format),
+                           args.batch_size, done, args.keep)
+
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as out:
+        def write(result):
+            count, lines = result
+            out.write(lines)
+            out.flush()
+            progress.add(count)
+
+        if args.workers == 0:
+            for batch in batches:
+                write(annotate_batch(batch, now))
+            progress.add(0, force=True)
+            return
+
+        # Объекты, созданные при загрузке, не трогаются сборщиком мусора в воркерах
+        gc.freeze()
+        pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=init_worker, initargs=(args.threads,))
+        pending = deque() if not args.unordered else set()
+        try:
+            for batch in batches:
+                if len(pending) >= args.window:
+                    if args.unordered:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            write(future.result())
+                    else:
+                        write(pending.popleft().result())
+                future = pool.submit(annotate_batch, batch, now)
+                if args.unordered:
+                    pending.add(future)
+                else:
+                    pending.append(future)
+            for future in pending:
+                write(future.result())
+        except KeyboardInterrupt:
+            print("Прервано; продолжить с того же места: --resume", file=sys.stderr)
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise SystemExit(130)
+        pool.shutdown()
+        progress.add(0, force=True)
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Офлайн-разметка корпуса интентами и сущностями")
+    parser.add_argument("--input", required=True, help="CSV или JSONL (строка JSON или объект)")
+    parser.add_argument("--output", required=True, help="JSONL с результатами")
+    parser.add_argument("--format", choices=["auto", "csv", "jsonl"], default="auto")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--keep", nargs="*", default=[], help="поля входной записи, копируемые в результат")
+    parser.add_argument("--workers", type=int, default=cpus, help="процессов (0 — в текущем)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="intra-op потоков инференса на воркер (по умолчанию cpu/workers)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--window", type=int, default=0,
+                        help="батчей в работе одновременно (по умолчанию 2 на воркер)")
+    parser.add_argument("--unordered", action="store_true", help="писать батчи по готовности")
+    parser.add_argument("--resume", action="store_true", help="дописать к существующему --output")
+    parser.add_argument("--now", help="опорная дата для «завтра», «в субботу» (ISO), по умолчанию сейчас")
+    args = parser.parse_args()
+    if args.threads <= 0:
+        args.threads = max(1, cpus // max(1, args.workers))
+    if args.window <= 0:
+        args.window = 2 * max(1, args.workers)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
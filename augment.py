@@ -0,0 +1,22 @@
+import random
+
+# Добавки, которые не меняют интент команды
+PREFIXES = ["", "", "пожалуйста ", "слушай ", "эй ", "а "]
+SUFFIXES = ["", "", " пожалуйста", " сейчас", " быстро"]
+ROOMS = ["", "", " на кухне", " в спальне", " в зале", " в гостиной"]
+TIMES = ["", "", " завтра", " утром", " вечером", " в субботу", " на 7 утра"]
+
+
+def generate_variants(texts, n, seed=42):
+    """
+    Генерирует n вариантов фраз из texts: вежливые префиксы и суффиксы,
+    комнаты, временные выражения. Возвращает список (исходный индекс, вариант).
+    """
+    rng = random.Random(seed)
+    variants = []
+    for _ in range(n):
+        idx = rng.randrange(len(texts))
+        text = texts[idx].lower()
+        text = rng.choice(PREFIXES) + text + rng.choice(ROOMS) + rng.choice(TIMES) + rng.choice(SUFFIXES)
+        variants.append((idx, " ".join(text.split())))
+    return variants
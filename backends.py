@@ -0,0 +1,304 @@
+"""
+Бэкенды инференса модели интентов.
+
+  torch       — PyTorch eager fp32 (по умолчанию)
+  torch-int8  — PyTorch с динамической int8-квантизацией Linear-слоёв
+  torch-mmap, torch-mmap-bf16, torch-mmap-int8
+              — PyTorch, веса из safetensors через mmap, общие для всех процессов
+                (см. mmap_weights.py)
+  onnx        — ONNX Runtime, model.onnx из каталога модели
+  onnx-int8   — ONNX Runtime, квантизованный model.int8.onnx
+
+Экспорт и проверка паритета с fp32:
+  python backends.py export --model ./finetuned_model
+  python backends.py parity --backend onnx-int8 --tolerance 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from cache import LRUCache
+from metrics import stage
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+# Потоки intra-op на процесс; 0 — значение библиотеки по умолчанию
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0"))
+# Кодировок токенизатора в памяти на бэкенд; 0 — токенизировать каждый раз
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "50000"))
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class TokenCache:
+    """
+    Кодировки токенизатора по тексту. Батч собирается из закэшированных строк и
+    закодированных одним вызовом новых, затем добивается паддингом до самой длинной,
+    как tokenizer(texts, padding=True, truncation=True).
+    """
+
+    def __init__(self, tokenizer, maxsize=TOKEN_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.cache = LRUCache(maxsize, ttl=float("inf")) if maxsize else None
+
+    def __call__(self, texts, return_tensors):
+        if self.cache is None:
+            return self.tokenizer(texts, return_tensors=return_tensors, truncation=True, padding=True)
+        encoded = [self.cache.get(text) for text in texts]
+        missing = {}
+        for i, e in enumerate(encoded):
+            if e is None:
+                missing.setdefault(texts[i], []).append(i)
+        if missing:
+            fresh = self.tokenizer(list(missing), truncation=True)
+            for n, (text, positions) in enumerate(missing.items()):
+                encoding = {key: np.array(values[n], dtype=np.int64) for key, values in fresh.items()}
+                self.cache.put(text, encoding)
+                for i in positions:
+                    encoded[i] = encoding
+        batch = self.pad(encoded)
+        if return_tensors == "pt":
+            import torch
+            batch = {key: torch.from_numpy(value) for key, value in batch.items()}
+        return batch
+
+    def pad(self, encoded):
+        length = max(len(e["input_ids"]) for e in encoded)
+        fill = {"input_ids": self.tokenizer.pad_token_id,
+                "token_type_ids": self.tokenizer.pad_token_type_id}
+        left = self.tokenizer.padding_side == "left"
+        batch = {}
+        for key in encoded[0]:
+            out = np.full((len(encoded), length), fill.get(key, 0), dtype=np.int64)
+            for row, e in zip(out, encoded):
+                if left:
+                    row[length - len(e[key]):] = e[key]
+                else:
+                    row[:len(e[key])] = e[key]
+            batch[key] = out
+        return batch
+
+    def stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+
+class TorchBackend:
+    """PyTorch eager, fp32"""
+    name = "torch"
+
+    def __init__(self, model_dir):
+        import torch
+
+        self.torch = torch
+        if INFERENCE_THREADS:
+            torch.set_num_threads(INFERENCE_THREADS)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.encode = TokenCache(self.tokenizer)
+        self.model = self._prepare(self._load_model(model_dir))
+        self.model.eval()
+
+    def _load_model(self, model_dir):
+        from transformers import AutoModelForSequenceClassification
+
+        return AutoModelForSequenceClassification.from_pretrained(model_dir)
+
+    def _prepare(self, model):
+        return model
+
+    def predict_proba(self, texts):
+        with stage("tokenize"):
+            inputs = self.encode(texts, "pt")
+        with stage("forward"), self.torch.no_grad():
+            logits = self.model(**inputs).logits
+        return softmax(logits.float().cpu().numpy())
+
+
+class TorchInt8Backend(TorchBackend):
+    """PyTorch с динамической int8-квантизацией"""
+    name = "torch-int8"
+
+    def _prepare(self, model):
+        return self.torch.quantization.quantize_dynamic(model, {self.torch.nn.Linear}, dtype=self.torch.qint8)
+
+
+class TorchMmapBackend(TorchBackend):
+    """PyTorch, веса отображены из model.safetensors в память"""
+    name = "torch-mmap"
+    weights_dtype = "fp32"
+
+    def _load_model(self, model_dir):
+        from mmap_weights import load_model
+
+        return load_model(model_dir, self.weights_dtype)
+
+
+class TorchMmapBf16Backend(TorchMmapBackend):
+    """PyTorch, bf16-веса через mmap"""
+    name = "torch-mmap-bf16"
+    weights_dtype = "bf16"
+
+
+class TorchMmapInt8Backend(TorchMmapBackend):
+    """PyTorch, int8-веса через mmap с деквантизацией на лету"""
+    name = "torch-mmap-int8"
+    weights_dtype = "int8"
+
+
+class OnnxBackend:
+    """ONNX Runtime, CPU"""
+    name = "onnx"
+    filename = ONNX_FILE
+
+    def __init__(self, model_dir):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError(
+                "Для ONNX-бэкенда нужен onnxruntime. "
+                "Установите его командой:\n"
+                "pip install onnx onnxruntime"
+            )
+        path = os.path.join(model_dir, self.filename)
+        if not os.path.exists(path):
+            raise RuntimeError(
+                f"Файл {path} не найден. Экспортируйте модель командой:\n"
+                f"python backends.py export --model {model_dir}"
+            )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.encode = TokenCache(self.tokenizer)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = INFERENCE_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def predict_proba(self, texts):
+        with stage("tokenize"):
+            inputs = self.encode(texts, "np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        with stage("forward"):
+            logits = self.session.run(None, feed)[0]
+        return softmax(logits)
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """ONNX Runtime, int8-веса"""
+    name = "onnx-int8"
+    filename = ONNX_INT8_FILE
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (TorchBackend, TorchInt8Backend, TorchMmapBackend, TorchMmapBf16Backend,
+                    TorchMmapInt8Backend, OnnxBackend, OnnxInt8Backend)
+}
+
+
+def load_backend(name, model_dir):
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд '{name}', доступны: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_dir)
+
+
+def export_onnx(model_dir, quantize=True, opset=14):
+    """Экспорт дообученной модели в ONNX (и int8-версию) рядом с чекпоинтом"""
+    import torch
+    from transformers import AutoModelForSequenceClassification
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+
+    sample = tokenizer(["включи свет на кухне"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    path = os.path.join(model_dir, ONNX_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            path,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    print(f"ONNX-модель сохранена в {path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        int8_path = os.path.join(model_dir, ONNX_INT8_FILE)
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        print(f"int8-модель сохранена в {int8_path}")
+
+
+def parity_check(backend_name, model_dir, data_path="data.csv", tolerance=0.05, batch_size=32):
+    """Сравнивает бэкенд с эталонной fp32-моделью на data.csv"""
+    import pandas as pd
+
+    texts = [t.lower() for t in pd.read_csv(data_path)["text"].dropna()]
+    reference = TorchBackend(model_dir)
+    candidate = load_backend(backend_name, model_dir)
+
+    def run(backend):
+        start = time.perf_counter()
+        probs = np.concatenate([
+            backend.predict_proba(texts[i:i + batch_size])
+            for i in range(0, len(texts), batch_size)
+        ])
+        return probs, time.perf_counter() - start
+
+    ref_probs, ref_time = run(reference)
+    cand_probs, cand_time = run(candidate)
+
+    ref_idx = ref_probs.argmax(axis=1)
+    cand_idx = cand_probs.argmax(axis=1)
+    mismatches = [texts[i] for i in np.nonzero(ref_idx != cand_idx)[0]]
+    rows = np.arange(len(texts))
+    conf_diff = np.abs(ref_probs[rows, ref_idx] - cand_probs[rows, cand_idx])
+
+    print(f"Примеров: {len(texts)}")
+    print(f"Совпадение интента: {1 - len(mismatches) / len(texts):.4f} ({len(mismatches)} расхождений)")
+    print(f"Разница уверенности: max {conf_diff.max():.4f}, mean {conf_diff.mean():.4f}")
+    print(f"Время: fp32 {ref_time:.3f}s, {backend_name} {cand_time:.3f}s")
+    for text in mismatches:
+        print(f"  расхождение: {text}")
+
+    return not mismatches and conf_diff.max() <= tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэкенды инференса модели интентов")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="экспорт чекпоинта в ONNX")
+    export.add_argument("--model", default="./finetuned_model")
+    export.add_argument("--no-quantize", action="store_true")
+
+    parity = sub.add_parser("parity", help="проверка паритета с fp32 на data.csv")
+    parity.add_argument("--model", default="./finetuned_model")
+    parity.add_argument("--backend", default="onnx", choices=list(BACKENDS))
+    parity.add_argument("--data", default="data.csv")
+    parity.add_argument("--tolerance", type=float, default=0.05)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_onnx(args.model, quantize=not args.no_quantize)
+    else:
+        ok = parity_check(args.backend, args.model, args.data, args.tolerance)
+        print("OK" if ok else "FAIL")
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
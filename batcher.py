@@ -0,0 +1,89 @@
+import os
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+from metrics import merge_trace, start_trace, stop_trace
+
+
+class MicroBatcher:
+    """
+    Собирает конкурентные запросы в батч и обрабатывает их одним вызовом.
+    batch_fn принимает список входов и возвращает список результатов той же длины.
+    Этапы metrics.stage внутри batch_fn попадают в разбивку каждого запроса батча.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._start()
+
+    def _start(self):
+        # Потоки не переживают fork: в дочернем процессе очередь и поток создаются заново
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, args=(self._queue,), name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Ставит вход в очередь, возвращает Future с результатом"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        future = self.submit(item)
+        result = future.result(timeout=timeout)
+        merge_trace(future.stages)
+        return result
+
+    def _collect(self, q):
+        # Блокируемся до первого запроса и забираем всё, что уже в очереди.
+        # Одиночный запрос уходит сразу; если запросы идут параллельно,
+        # ждём остальных не дольше max_wait
+        batch = [q.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        if len(batch) == 1:
+            return batch
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self, q):
+        while True:
+            batch = self._collect(q)
+            items = [item for item, _ in batch]
+            stages = start_trace()
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    # Иначе лишние Future не получили бы результат до таймаута вызывающего
+                    raise RuntimeError(f"batch_fn вернула {len(results)} результатов на {len(items)} входов")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                stop_trace()
+            for (_, future), result in zip(batch, results):
+                future.stages = stages
+                future.set_result(result)
@@ -0,0 +1,208 @@
+"""
+Бенчмарк и нагрузочный тест без запущенного сервера.
+
+Этапы вызываются в процессе: predict_intent, extract_entities, parse_datetime
+и Flask-приложение через test_client (POST /nlp). Входные данные — data.csv
+плюс сгенерированные варианты фраз.
+
+  python bench.py                                  # все этапы, замкнутый цикл
+  python bench.py --stages parse_datetime entities
+  python bench.py --stages app --rate 200 --duration 10 --concurrency 8   # открытый цикл
+  python bench.py --output new.json --compare old.json --max-regression 0.2
+
+Результаты сохраняются в JSON; --compare печатает изменения относительно
+прошлого прогона и завершается с кодом 1 при регрессии p99 или пропускной способности.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from augment import generate_variants
+
+STAGES = ["parse_datetime", "entities", "intent", "app"]
+
+
+def load_texts(data_path, variants, seed=42):
+    texts = [t.lower() for t in pd.read_csv(data_path)["text"].dropna()]
+    return texts + [v for _, v in generate_variants(texts, variants, seed)]
+
+
+def make_stage(name, cache=True):
+    """Возвращает функцию f(text), выполняющую этап целиком"""
+    if name == "parse_datetime":
+        from entity_extractor import parse_datetime
+        return parse_datetime
+    if name == "entities":
+        from entity_extractor import extract_entities
+        return extract_entities
+    if name == "intent":
+        from server import predict_intent
+        return predict_intent
+    if name == "app":
+        import server
+        if not cache:
+            server.response_cache = None
+        client = server.app.test_client()
+
+        def post(text):
+            response = client.post("/nlp", json={"text": text})
+            if response.status_code != 200:
+                raise RuntimeError(f"/nlp вернул {response.status_code}")
+        return post
+    raise ValueError(f"Неизвестный этап '{name}', доступны: {', '.join(STAGES)}")
+
+
+def summarize(latencies, elapsed, errors=0):
+    lat = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(float(lat.mean()), 4) if len(lat) else None,
+        "p50_ms": round(float(np.percentile(lat, 50)), 4) if len(lat) else None,
+        "p95_ms": round(float(np.percentile(lat, 95)), 4) if len(lat) else None,
+        "p99_ms": round(float(np.percentile(lat, 99)), 4) if len(lat) else None,
+        "max_ms": round(float(lat.max()), 4) if len(lat) else None,
+    }
+
+
+def run_closed_loop(fn, texts, repeat, warmup):
+    """Последовательные вызовы: чистая стоимость этапа"""
+    for text in texts[:warmup]:
+        fn(text)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            t0 = time.perf_counter()
+            fn(text)
+            latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_open_loop(fn, texts, rate, duration, concurrency):
+    """
+    Запросы приходят с постоянной частотой rate независимо от ответов.
+    Задержка считается от запланированного момента отправки, поэтому
+    очередь перед пулом тоже входит в неё (без coordinated omission).
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def call(text, scheduled):
+        nonlocal errors
+        try:
+            fn(text)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - scheduled)
+
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(call, texts[i % len(texts)], scheduled)
+    result = summarize(latencies, time.perf_counter() - start, errors)
+    result["offered_rps"] = rate
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, max_regression):
+    """Печатает изменения относительно baseline; возвращает список регрессий"""
+    regressions = []
+    for name, res in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old:
+            continue
+        for key, worse_if_higher in (("p99_ms", True), ("throughput_rps", False)):
+            if not old.get(key) or res.get(key) is None:
+                continue
+            change = (res[key] - old[key]) / old[key]
+            print(f"  {name:15s} {key:15s} {old[key]:>10.3f} -> {res[key]:>10.3f} ({change:+.1%})")
+            if (change if worse_if_higher else -change) > max_regression:
+                regressions.append(f"{name}.{key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк NLP-сервера в процессе")
+    parser.add_argument("--data", default="data.csv")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--variants", type=int, default=500, help="сколько вариантов фраз сгенерировать")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0, help="запросов/с; >0 включает открытый цикл")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-cache", action="store_true", help="отключить кэш ответов для этапа app")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    texts = load_texts(args.data, args.variants)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "mode": "open" if args.rate > 0 else "closed",
+        "config": vars(args),
+        "texts": len(texts),
+        "stages": {},
+    }
+
+    for name in args.stages:
+        fn = make_stage(name, cache=not args.no_cache)
+        if args.rate > 0:
+            res = run_open_loop(fn, texts, args.rate, args.duration, args.concurrency)
+        else:
+            res = run_closed_loop(fn, texts, args.repeat, args.warmup)
+        report["stages"][name] = res
+        if res["p50_ms"] is None:
+            print(f"{name:15s} нет успешных запросов, ошибок {res['errors']}")
+            continue
+        print(f"{name:15s} {res['throughput_rps']:>10.1f} rps  "
+              f"p50 {res['p50_ms']:.3f}  p95 {res['p95_ms']:.3f}  p99 {res['p99_ms']:.3f} ms"
+              + (f"  ошибок {res['errors']}" if res["errors"] else ""))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Сравнение с {args.compare} ({baseline.get('git')}):")
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
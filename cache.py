@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from temporal import TIME_RE
+
+SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Нормализация текста запроса: нижний регистр, схлопнутые пробелы"""
+    return SPACES_RE.sub(" ", text).strip().lower()
+
+
+def time_bucket(text, now):
+    """
+    Корзина времени, в пределах которой ответ на text не меняется.
+    Относительные даты зависят от текущего дня, а перенос будильника
+    на завтра — ещё и от текущей минуты, если в тексте есть время.
+    """
+    if TIME_RE.search(text):
+        return now.strftime("%Y-%m-%d %H:%M")
+    return now.strftime("%Y-%m-%d")
+
+
+def lru_stats(fn):
+    """Счётчики функции под functools.lru_cache в формате LRUCache.stats"""
+    info = fn.cache_info()
+    total = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+    }
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с TTL и счётчиками попаданий, промахов и вытеснений"""
+
+    def __init__(self, maxsize=10000, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    Одновременные вызовы с одинаковым ключом выполняют одно вычисление
+    и получают его результат (или исключение). Результаты не хранятся.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
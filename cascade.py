@@ -0,0 +1,184 @@
+"""
+Каскадный классификатор: быстрые правила перед моделью.
+
+Правило срабатывает только на однозначных шаблонах вида
+«[пожалуйста] глагол устройство [в комнате] [пожалуйста]» в любом порядке слов:
+ровно один глагол включения/выключения, ровно одно устройство, остальные
+слова — только комнаты, предлоги и вежливые добавки. Всё остальное
+(числа, каналы, «ярче», «полностью»...) уходит в модель.
+
+Отчёт о точности правил на data.csv:
+  python cascade.py
+  python cascade.py --with-model      # плюс точность всего каскада и одной модели
+"""
+import argparse
+import re
+import threading
+
+from entity_extractor import catalog
+
+RULE_CONFIDENCE = 0.99
+
+VERBS = {
+    "on": ["включи", "включить", "зажги", "запусти"],
+    "off": ["выключи", "выключить", "отключи", "погаси"],
+}
+DEVICES = {
+    "light": ["свет", "лампу", "лампа", "лампы", "лампочку", "лампочки"],
+    "tv": ["телевизор", "тв", "телик", "телек"],
+    "conditioner": ["кондиционер", "кондей", "кондишку", "кондишн"],
+    "music": ["музыку", "музыка"],
+}
+RULES = {
+    ("on", "light"): "turn_on_light",
+    ("off", "light"): "turn_off_light",
+    ("on", "tv"): "turn_on_tv",
+    ("off", "tv"): "turn_off_tv",
+    ("on", "conditioner"): "turn_on_conditioner",
+    ("off", "conditioner"): "turn_off_conditioner",
+    ("on", "music"): "play_music",
+    ("off", "music"): "stop_music",
+}
+# Слова, которые не меняют смысл команды; ещё нейтральны все формы комнат из словаря
+NEUTRAL = {
+    "в", "во", "на", "комнате", "коридоре", "детской", "балконе",
+    "пожалуйста", "сейчас", "быстро", "тут", "там",
+}
+
+WORD_RE = re.compile(r"\w+")
+
+# Слово -> ("verb", полярность) | ("device", группа) | ("neutral", None)
+TOKEN_TABLE = {}
+for polarity, words in VERBS.items():
+    for word in words:
+        TOKEN_TABLE[word] = ("verb", polarity)
+for group, words in DEVICES.items():
+    for word in words:
+        TOKEN_TABLE[word] = ("device", group)
+for word in NEUTRAL:
+    TOKEN_TABLE.setdefault(word, ("neutral", None))
+
+
+def is_room(word):
+    return any(kind == "room" for kind, _, _ in catalog().lookup(word))
+
+
+def match_rules(text):
+    """Интент и уверенность, если текст однозначно подходит под правило, иначе None"""
+    verb = device = None
+    for word in WORD_RE.findall(text.lower()):
+        kind, value = TOKEN_TABLE.get(word, (None, None))
+        if kind is None:
+            if not is_room(word):
+                return None
+            continue
+        if kind == "verb":
+            if verb is not None:
+                return None
+            verb = value
+        elif kind == "device":
+            if device is not None:
+                return None
+            device = value
+    intent = RULES.get((verb, device))
+    if intent is None:
+        return None
+    return intent, RULE_CONFIDENCE
+
+
+class Cascade:
+    """
+    Правила -> модель. model_batch_fn(texts) возвращает [(интент, уверенность)].
+    Считает, сколько запросов закрыл каждый этап; частичные гипотезы потокового
+    распознавания (predict_stream) считаются отдельно от запросов.
+    """
+
+    def __init__(self, model_fn, model_batch_fn=None, enabled=True):
+        self.model_fn = model_fn
+        self.model_batch_fn = model_batch_fn
+        self.enabled = enabled
+        self.hits = {"rules": 0, "model": 0, "stream_rules": 0, "stream_model": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, stage, n=1):
+        with self._lock:
+            self.hits[stage] += n
+
+    def _route(self, text):
+        """(этап, результат)"""
+        if self.enabled:
+            result = match_rules(text)
+            if result is not None:
+                return "rules", result
+        return "model", self.model_fn(text)
+
+    def predict(self, text):
+        stage, result = self._route(text)
+        self._count(stage)
+        return result
+
+    def predict_stream(self, text):
+        stage, result = self._route(text)
+        self._count("stream_" + stage)
+        return result
+
+    def predict_batch(self, texts):
+        results = [match_rules(t) if self.enabled else None for t in texts]
+        rest = [i for i, r in enumerate(results) if r is None]
+        if rest:
+            predicted = self.model_batch_fn([texts[i] for i in rest])
+            for i, r in zip(rest, predicted):
+                results[i] = r
+        self._count("rules", len(texts) - len(rest))
+        self._count("model", len(rest))
+        return results
+
+    def stats(self):
+        with self._lock:
+            total = self.hits["rules"] + self.hits["model"]
+            return {
+                "enabled": self.enabled,
+                **self.hits,
+                "rules_share": round(self.hits["rules"] / total, 4) if total else 0.0,
+            }
+
+
+def report(data_path, with_model=False):
+    import pandas as pd
+
+    df = pd.read_csv(data_path).dropna()
+    texts = [t.lower() for t in df["text"]]
+    labels = list(df["label"])
+
+    matched = [(i, match_rules(t)) for i, t in enumerate(texts)]
+    matched = [(i, r[0]) for i, r in matched if r is not None]
+    wrong = [(texts[i], intent, labels[i]) for i, intent in matched if intent != labels[i]]
+
+    print(f"Примеров: {len(texts)}")
+    print(f"Покрытие правилами: {len(matched) / len(texts):.1%} ({len(matched)})")
+    if matched:
+        print(f"Точность правил: {1 - len(wrong) / len(matched):.4f}")
+    for text, got, expected in wrong:
+        print(f"  ошибка: «{text}» -> {got}, ожидалось {expected}")
+
+    if with_model:
+        from server import predict_intent_batch
+
+        model_only = [intent for intent, _ in predict_intent_batch(texts)]
+        cascade = Cascade(None, predict_intent_batch)
+        cascaded = [intent for intent, _ in cascade.predict_batch(texts)]
+        model_acc = sum(p == l for p, l in zip(model_only, labels)) / len(labels)
+        cascade_acc = sum(p == l for p, l in zip(cascaded, labels)) / len(labels)
+        print(f"Точность модели: {model_acc:.4f}, каскада: {cascade_acc:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчёт о правилах каскада на data.csv")
+    parser.add_argument("--data", default="data.csv")
+    parser.add_argument("--with-model", action="store_true")
+    args = parser.parse_args()
+    report(args.data, args.with_model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Дистилляция дообученной модели (учитель) в меньшую модель-ученика для CPU.
+
+Ученик — та же архитектура с меньшим числом слоёв и/или более узким скрытым слоем.
+При неизменной ширине эмбеддинги и часть слоёв копируются из учителя.
+Ученик обучается на мягких логитах учителя по data.csv и сгенерированным
+вариантам фраз (для исходных фраз добавляется обычная cross-entropy).
+
+  python distill.py --layers 1 --output ./distilled_model
+  python distill.py --layers 2 --hidden-size 128 --output ./distilled_model
+
+Результат сохраняется в формате ./finetuned_model; сервер подхватит его через
+MODEL_NAME=./distilled_model. Сравнение учителя и ученика (точность, размер,
+задержка) печатается и сохраняется в <output>/distill_report.json.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from datasets import Dataset
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from augment import generate_variants
+
+
+def split_data(data_path):
+    """То же разбиение 80/20 с seed=42, что и в train_finetune.py"""
+    df = pd.read_csv(data_path)
+    labels = list(df["label"].unique())
+    label2id = {l: i for i, l in enumerate(labels)}
+    df["label_id"] = df["label"].map(label2id)
+    split = Dataset.from_pandas(df).train_test_split(test_size=0.2, seed=42)
+    train = [(t.lower(), l) for t, l in zip(split["train"]["text"], split["train"]["label_id"])]
+    test = [(t.lower(), l) for t, l in zip(split["test"]["text"], split["test"]["label_id"])]
+    return train, test
+
+
+def build_student(teacher, layers, hidden_size):
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = layers
+    same_width = hidden_size in (None, config.hidden_size)
+    if not same_width:
+        ratio = config.intermediate_size / config.hidden_size
+        head_dim = config.hidden_size // config.num_attention_heads
+        config.hidden_size = hidden_size
+        config.intermediate_size = int(hidden_size * ratio)
+        config.num_attention_heads = max(1, hidden_size // head_dim)
+    student = AutoModelForSequenceClassification.from_config(config)
+
+    if same_width:
+        # Эмбеддинги, равномерно выбранные слои энкодера и голова — из учителя
+        t_base = getattr(teacher, teacher.base_model_prefix)
+        s_base = getattr(student, student.base_model_prefix)
+        s_base.embeddings.load_state_dict(t_base.embeddings.state_dict())
+        picked = np.linspace(0, teacher.config.num_hidden_layers - 1, layers).round().astype(int)
+        for s_idx, t_idx in enumerate(picked):
+            s_base.encoder.layer[s_idx].load_state_dict(t_base.encoder.layer[t_idx].state_dict())
+        if getattr(t_base, "pooler", None) is not None:
+            s_base.pooler.load_state_dict(t_base.pooler.state_dict())
+        student.classifier.load_state_dict(teacher.classifier.state_dict())
+    return student
+
+
+@torch.no_grad()
+def predict_logits(model, tokenizer, texts, batch_size=64):
+    model.eval()
+    out = []
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[i:i + batch_size], return_tensors="pt", truncation=True, padding=True)
+        out.append(model(**inputs).logits)
+    return torch.cat(out)
+
+
+def distill(teacher, student, tokenizer, texts, hard_labels, epochs, batch_size, lr, temperature, alpha):
+    """hard_labels[i] == -100 — только мягкие цели учителя"""
+    teacher_logits = predict_logits(teacher, tokenizer, texts)
+    labels = torch.tensor(hard_labels)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=0.01)
+    order = list(range(len(texts)))
+
+    for epoch in range(epochs):
+        student.train()
+        random.shuffle(order)
+        total = 0.0
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            inputs = tokenizer([texts[j] for j in idx], return_tensors="pt", truncation=True, padding=True)
+            logits = student(**inputs).logits
+            soft = F.kl_div(
+                F.log_softmax(logits / temperature, dim=-1),
+                F.softmax(teacher_logits[idx] / temperature, dim=-1),
+                reduction="batchmean",
+            ) * temperature ** 2
+            batch_labels = labels[idx]
+            if (batch_labels != -100).any():
+                hard = F.cross_entropy(logits, batch_labels, ignore_index=-100)
+                loss = alpha * soft + (1 - alpha) * hard
+            else:
+                loss = soft
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(idx)
+        print(f"Эпоха {epoch + 1}/{epochs}: loss {total / len(texts):.4f}")
+    student.eval()
+
+
+def evaluate(model, tokenizer, test):
+    texts = [t for t, _ in test]
+    labels = np.array([l for _, l in test])
+    preds = predict_logits(model, tokenizer, texts).argmax(dim=-1).numpy()
+
+    # Задержка одиночного запроса, как в server.predict_intent
+    latencies = []
+    with torch.no_grad():
+        for text in texts:
+            start = time.perf_counter()
+            model(**tokenizer(text, return_tensors="pt", truncation=True))
+            latencies.append(time.perf_counter() - start)
+    params = sum(p.numel() for p in model.parameters())
+    return {
+        "accuracy": round(float((preds == labels).mean()), 4),
+        "params": params,
+        "size_mb": round(params * 4 / 2**20, 2),
+        "latency_mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+        "latency_p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Дистилляция модели интентов")
+    parser.add_argument("--teacher", default="./finetuned_model")
+    parser.add_argument("--output", default="./distilled_model")
+    parser.add_argument("--data", default="data.csv")
+    parser.add_argument("--layers", type=int, default=1, help="слоёв энкодера у ученика")
+    parser.add_argument("--hidden-size", type=int, default=None, help="ширина ученика (по умолчанию как у учителя)")
+    parser.add_argument("--variants", type=int, default=2000, help="сгенерированных фраз для мягких целей")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.7, help="вес мягкой цели для исходных фраз")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.teacher)
+    teacher = AutoModelForSequenceClassification.from_pretrained(args.teacher)
+    teacher.eval()
+    student = build_student(teacher, args.layers, args.hidden_size)
+
+    train, test = split_data(args.data)
+    train_texts = [t for t, _ in train]
+    variants = [v for _, v in generate_variants(train_texts, args.variants, args.seed)]
+    texts = train_texts + variants
+    hard_labels = [l for _, l in train] + [-100] * len(variants)
+
+    distill(teacher, student, tokenizer, texts, hard_labels, args.epochs,
+            args.batch_size, args.lr, args.temperature, args.alpha)
+
+    os.makedirs(args.output, exist_ok=True)
+    student.save_pretrained(args.output)
+    tokenizer.save_pretrained(args.output)
+    print(f"Модель сохранена в {args.output}")
+
+    report = {
+        "teacher": {"path": args.teacher, "layers": teacher.config.num_hidden_layers,
+                    "hidden_size": teacher.config.hidden_size, **evaluate(teacher, tokenizer, test)},
+        "student": {"path": args.output, "layers": student.config.num_hidden_layers,
+                    "hidden_size": student.config.hidden_size, **evaluate(student, tokenizer, test)},
+        "eval_examples": len(test),
+        "config": vars(args),
+    }
+    print(f"{'':8s} {'слои':>5s} {'ширина':>7s} {'accuracy':>9s} {'MB':>8s} {'mean ms':>8s} {'p99 ms':>8s}")
+    for name in ("teacher", "student"):
+        r = report[name]
+        print(f"{name:8s} {r['layers']:>5d} {r['hidden_size']:>7d} {r['accuracy']:>9.4f} "
+              f"{r['size_mb']:>8.2f} {r['latency_mean_ms']:>8.3f} {r['latency_p99_ms']:>8.3f}")
+    with open(os.path.join(args.output, "distill_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
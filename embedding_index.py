@@ -0,0 +1,289 @@
+"""
+Классификатор интентов по ближайшим соседям в индексе эмбеддингов.
+
+Индекс — каталог с тремя файлами:
+  meta.json         модель-энкодер, размерность, число записей
+  embeddings.f16    нормированные эмбеддинги подряд, float16 (читаются через mmap)
+  items.jsonl       текст и интент каждой записи
+
+Классификация — батчевое косинусное сходство с индексом, top-k соседей
+голосуют с весом, равным сходству. Новые примеры дописываются в конец
+файлов без переобучения и без перестройки индекса.
+
+  python embedding_index.py build --data data.csv --output ./intent_index
+  python embedding_index.py add --index ./intent_index --text "вруби свет" --label turn_on_light
+  python embedding_index.py eval --data data.csv      # точность и задержка против дообученной головы
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.f16"
+ITEMS_FILE = "items.jsonl"
+DTYPE = np.float16
+CHUNK_ROWS = 65536  # строк индекса, переводимых во float32 за раз
+
+
+class SentenceEncoder:
+    """Эмбеддинг фразы: mean pooling последнего слоя энкодера по маске внимания"""
+
+    def __init__(self, model_dir):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        from backends import TokenCache
+
+        self.torch = torch
+        self.model_dir = model_dir
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.tokens = TokenCache(self.tokenizer)
+        self.model = AutoModel.from_pretrained(model_dir)
+        self.model.eval()
+        self.dim = self.model.config.hidden_size
+
+    def encode(self, texts, batch_size=64):
+        out = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokens(texts[i:i + batch_size], "pt")
+            with self.torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            out.append(pooled.numpy())
+        vectors = np.concatenate(out) if out else np.zeros((0, self.dim), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+
+class IntentIndex:
+    def __init__(self, path, encoder=None, top_k=5):
+        self.path = path
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._read_meta()
+        self.encoder = encoder or SentenceEncoder(self.meta["encoder"])
+        self._load()
+
+    @property
+    def intents(self):
+        return self.snapshot[1]
+
+    @property
+    def label_ids(self):
+        return self.snapshot[2]
+
+    def _meta_mtime(self):
+        return os.stat(os.path.join(self.path, META_FILE)).st_mtime_ns
+
+    def _read_meta(self):
+        with open(os.path.join(self.path, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+    def refresh(self):
+        """Подхватывает примеры, дописанные другим процессом"""
+        if self._mtime == self._meta_mtime():
+            return
+        with self._lock:
+            if self._mtime != self._meta_mtime():
+                self._read_meta()
+                self._load()
+
+    def _load(self):
+        mtime = self._meta_mtime()
+        count, dim = self.meta["count"], self.meta["dim"]
+        if count:
+            embeddings = np.memmap(os.path.join(self.path, EMBEDDINGS_FILE),
+                                   dtype=DTYPE, mode="r", shape=(count, dim))
+        else:
+            embeddings = np.zeros((0, dim), dtype=DTYPE)
+        with open(os.path.join(self.path, ITEMS_FILE), encoding="utf-8") as f:
+            items = [json.loads(line) for _, line in zip(range(count), f)]
+        intents = sorted({item["label"] for item in items})
+        intent_ids = {intent: i for i, intent in enumerate(intents)}
+        label_ids = np.array([intent_ids[item["label"]] for item in items], dtype=np.int32)
+        # Публикуется одним присваиванием: параллельный predict_batch видит либо
+        # старый, либо новый индекс целиком (номера интентов сдвигаются при новой метке)
+        self.snapshot = (embeddings, intents, label_ids)
+        self._mtime = mtime
+
+    @classmethod
+    def build(cls, path, texts, labels, encoder_dir):
+        """Создаёт индекс с нуля"""
+        os.makedirs(path, exist_ok=True)
+        encoder = SentenceEncoder(encoder_dir)
+        for name in (EMBEDDINGS_FILE, ITEMS_FILE):
+            open(os.path.join(path, name), "wb").close()
+        _write_meta(path, {"encoder": encoder_dir, "dim": encoder.dim, "count": 0})
+        index = cls(path, encoder)
+        index.add(texts, labels)
+        return index
+
+    @classmethod
+    def load(cls, path, top_k=5):
+        return cls(path, top_k=top_k)
+
+    def add(self, texts, labels):
+        """Дописывает примеры в конец индекса; meta.json обновляется последним"""
+        texts = [t.lower() for t in texts]
+        vectors = self.encoder.encode(texts).astype(DTYPE)
+        with self._lock:
+            self._read_meta()
+            self._truncate()
+            with open(os.path.join(self.path, EMBEDDINGS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(os.path.join(self.path, ITEMS_FILE), "a", encoding="utf-8") as f:
+                for text, label in zip(texts, labels):
+                    f.write(json.dumps({"text": text, "label": label}, ensure_ascii=False) + "\n")
+            self.meta["count"] += len(texts)
+            _write_meta(self.path, self.meta)
+            self._load()
+
+    def _truncate(self):
+        """
+        Обрезает файлы до meta["count"] записей: строки, дописанные прерванным add
+        до обновления meta.json, иначе сдвинули бы соответствие эмбеддингов и меток.
+        """
+        count = self.meta["count"]
+        with open(os.path.join(self.path, EMBEDDINGS_FILE), "r+b") as f:
+            f.truncate(count * self.meta["dim"] * np.dtype(DTYPE).itemsize)
+        with open(os.path.join(self.path, ITEMS_FILE), "r+b") as f:
+            for _ in range(count):
+                f.readline()
+            f.truncate(f.tell())
+
+    def predict_batch(self, texts):
+        """[(интент, уверенность)]: взвешенное голосование top-k соседей"""
+        self.refresh()
+        embeddings, intents, label_ids = self.snapshot
+        if not len(label_ids):
+            return [("unknown_command", 0.0) for _ in texts]
+        queries = self.encoder.encode([t.lower() for t in texts])
+        sims = self.similarities(queries, embeddings)
+        k = min(self.top_k, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, idx in zip(sims, top):
+            weights = np.clip(row[idx], 0.0, None)
+            votes = np.bincount(label_ids[idx], weights=weights, minlength=len(intents))
+            best = int(votes.argmax())
+            total = weights.sum()
+            share = votes[best] / total if total > 0 else 0.0
+            # Доля голосов, умноженная на сходство с ближайшим соседом этого интента:
+            # далёкие от всех примеров фразы получают низкую уверенность
+            nearest = weights[label_ids[idx] == best].max()
+            results.append((intents[best], float(share * nearest)))
+        return results
+
+    def similarities(self, queries, embeddings):
+        """Косинусное сходство запросов со всеми записями; индекс читается кусками"""
+        sims = np.empty((len(queries), len(embeddings)), dtype=np.float32)
+        for start in range(0, len(embeddings), CHUNK_ROWS):
+            chunk = np.asarray(embeddings[start:start + CHUNK_ROWS], dtype=np.float32)
+            sims[:, start:start + len(chunk)] = queries @ chunk.T
+        return sims
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(path, META_FILE))
+
+
+def read_examples(data_path):
+    import pandas as pd
+
+    df = pd.read_csv(data_path).dropna()
+    return [t.lower() for t in df["text"]], list(df["label"])
+
+
+def evaluate(data_path, encoder_dir, index_path, top_k):
+    """Индекс из train-части против дообученной головы на той же eval-части, что в train_finetune.py"""
+    from datasets import Dataset
+    import pandas as pd
+
+    df = pd.read_csv(data_path)
+    # Порядок меток головы — как в train_finetune.py
+    head_labels = list(df["label"].unique())
+    split = Dataset.from_pandas(df).train_test_split(test_size=0.2, seed=42)
+    train_texts = [t.lower() for t in split["train"]["text"]]
+    test_texts = [t.lower() for t in split["test"]["text"]]
+    test_labels = split["test"]["label"]
+
+    index = IntentIndex.build(index_path, train_texts, split["train"]["label"], encoder_dir)
+    index.top_k = top_k
+
+    from backends import TorchBackend
+    head = TorchBackend(encoder_dir)
+
+    def run(predict):
+        preds, latencies = [], []
+        for text in test_texts:
+            start = time.perf_counter()
+            preds.append(predict(text))
+            latencies.append(time.perf_counter() - start)
+        acc = sum(p == l for p, l in zip(preds, test_labels)) / len(test_labels)
+        return acc, np.mean(latencies) * 1000, np.percentile(latencies, 99) * 1000
+
+    engines = {
+        "index": lambda t: index.predict(t)[0],
+        "head": lambda t: head_labels[int(head.predict_proba([t])[0].argmax())],
+    }
+    print(f"Eval-примеров: {len(test_texts)}, записей в индексе: {len(index.label_ids)}, top_k={top_k}")
+    for name, predict in engines.items():
+        acc, mean_ms, p99_ms = run(predict)
+        print(f"{name:6s} accuracy {acc:.4f}  mean {mean_ms:.3f} ms  p99 {p99_ms:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индекс эмбеддингов для классификации интентов")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="построить индекс по data.csv")
+    build.add_argument("--data", default="data.csv")
+    build.add_argument("--encoder", default="./finetuned_model")
+    build.add_argument("--output", default="./intent_index")
+
+    add = sub.add_parser("add", help="дописать примеры в индекс")
+    add.add_argument("--index", default="./intent_index")
+    add.add_argument("--text")
+    add.add_argument("--label")
+    add.add_argument("--data", help="CSV с колонками text,label")
+
+    ev = sub.add_parser("eval", help="точность и задержка против дообученной головы")
+    ev.add_argument("--data", default="data.csv")
+    ev.add_argument("--encoder", default="./finetuned_model")
+    ev.add_argument("--output", default="./intent_index_eval")
+    ev.add_argument("--top-k", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        texts, labels = read_examples(args.data)
+        index = IntentIndex.build(args.output, texts, labels, args.encoder)
+        print(f"Индекс сохранён в {args.output}: {len(index.label_ids)} записей, {len(index.intents)} интентов")
+    elif args.command == "add":
+        if args.data:
+            texts, labels = read_examples(args.data)
+        elif args.text and args.label:
+            texts, labels = [args.text], [args.label]
+        else:
+            parser.error("нужны --text и --label или --data")
+        index = IntentIndex.load(args.index)
+        index.add(texts, labels)
+        print(f"Добавлено {len(texts)}, всего записей: {len(index.label_ids)}")
+    else:
+        evaluate(args.data, args.encoder, args.output, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-from pymorphy2 import MorphAnalyzer
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import lru_cache
 import calendar
-import spacy
 import re
-
-nlp = spacy.load("ru_core_news_sm")
+from gazetteer import GazetteerStore
+from nlp_pipeline import get_nlp, get_morph
+from similarity import get_scorer
+from metrics import stage
 
 # Словари
 WEATHER_TIME_MAP = {
@@ -27,182 +28,44 @@ DAY_FORMS = {
     "воскресенье": ["воскресенье", "вс"]
 }
 WEEKEND_FORMS = ["выходные", "викенд", "конец недели"]
-ALARM_CMDS = ["будильник", "разбуди", "подъем", "пробуждение", "напомни"]
-WEATHER_CMDS = ["погода", "погоду", "прогноз", "температура", "осадки", "дождь", "снег", "град"]
-TIME_PERIODS = ["утро", "день", "вечер", "ночь", "обед"]
-DAYS_OF_WEEK = {
-    "понедельник": 0, "вторник": 1, "среда": 2, "среду":2, "четверг": 3,
-    "пятница": 4, "пятницу":4, "суббота": 5, "субботу":5, "воскресенье": 6
-}
-RELATIVE_DAYS = {
-    "сегодня": 0, "завтра": 1, "послезавтра": 2,
-    "послепослезавтра": 3, "через 3 дня": 3
-}
+# Нормальных форм pymorphy2 в памяти: одни и те же слова повторяются в запросах
+NORMAL_FORM_CACHE_SIZE = 50000
+# Команды, приложения, комнаты, устройства, дни недели и периоды суток —
+# в gazetteer.json; сервер читает скомпилированный артефакт (см. gazetteer.py)
+GAZETTEER_STORE = GazetteerStore()
 
-ROOM_MAP = {
-    "спальне": "спальня", "спальня": "спальня",
-    "кухне": "кухня", "кухня": "кухня",
-    "зале": "зал", "зал": "зал",
-    "гостиной": "гостиная", "гостиная": "гостиная",
-    "ванной": "ванная", "ванная": "ванная",
-    "повсюду": "дом", "доме": "дом", "дом": "дом", "везде": "дом",
-}
-
-DEVICES_MAP = {
-    "свет": ["свет", "лампа", "лампы", "лампочка", "лампочки"],
-    "кондиционер": ["кондиционер", "кондишн", "кондишнёр"],
-    "вентилятор": ["вентилятор", "вент"],
-    "шторы": ["штора", "шторы", "занавески"],
-    "телевизор": ["телевизор", "тв", "телик", "теле"],
-}
-
-APP_MAP = {
-    "youtube": ["ютуб", "youtube", "ютюб", "ютубе"],
-    "youtube music": ["ютуб музик", "ютуб музыка", "youtube music"],
-    "netflix": ["нетфликс", "netflix"],
-    "kinopoisk": ["кинопоиск", "кинопоиске"],
-    "spotify": ["спотифай", "spotify"],
-    "twitch": ["твич", "twitch"],
-    "prime video": ["прайм видео", "prime video"],
-    "wink": ["винк", "винке" "twitch"],
-}
-
-# Команды для управления видео
-VIDEO_CMDS = ["включи", "запусти", "поставь", "покажи", "включить", "запустить", "поставить", "показать"]
-
-morph = MorphAnalyzer()
+def catalog():
+    """Текущий скомпилированный словарь"""
+    return GAZETTEER_STORE.get()
 
 #def normalize_day(day_str):
 #    """Нормализует день недели с помощью pymorphy2"""
 #    parsed = morph.parse(day_str)[0]
 #    return parsed.normal_form
 
+@lru_cache(maxsize=NORMAL_FORM_CACHE_SIZE)
+def normal_form(word):
+    """Нормальная форма слова по первому разбору pymorphy2"""
+    return get_morph().parse(word)[0].normal_form
+
 def normalize_city(city_raw):
     """Нормализуем название города с помощью pymorphy2"""
     words = city_raw.strip().split()
-    city_words = [morph.parse(word)[0].normal_form for word in words]
+    city_words = [normal_form(word) for word in words]
     return " ".join(city_words)
 
 def parse_datetime(text, reference_date=None):
     """Парсинг временных выражений"""
-    if reference_date is None:
-        reference_date = datetime.now()
+    return catalog().temporal.parse(text, reference_date).as_dict()
 
-    text = text.lower()
-    result = {
-        "date": None,
-        "time": None,
-        "period": None,
-        "date_str": None,
-    }
-
-    # Поиск периода (утро, день, вечер, ночь)
-    for period in TIME_PERIODS:
-        if period in text:
-            result["period"] = period
-
-    # Поиск выходных
-    weekend_match = re.search(r"\b(выходн|викенд|конец недел)\w*\b", text)
-    if weekend_match:
-        # Находим ближайшие выходные (субботу)
-        current_weekday = reference_date.weekday()
-        days_to_saturday = (5 - current_weekday) % 7 or 7
-        saturday = reference_date + timedelta(days=days_to_saturday)
-        result["date"] = saturday
-        result["date_str"] = saturday.strftime("%Y-%m-%d")
-        result["period"] = "weekend"
-        return result  # Выходные имеют приоритет
-
-    # Поиск относительных дней (сегодня, завтра)
-    for day, offset in RELATIVE_DAYS.items():
-        if re.search(rf"\b{re.escape(day)}\b", text):
-            target_date = reference_date + timedelta(days=offset)
-            result["date"] = target_date
-            result["date_str"] = target_date.strftime("%Y-%m-%d")
-            break
-
-    # Поиск дней недели
-    for day_ru, day_num in DAYS_OF_WEEK.items():
-        if day_ru in text:
-            current_weekday = reference_date.weekday()
-            days_ahead = day_num - current_weekday
-            if days_ahead <= 0:
-                days_ahead += 7
-            target_date = reference_date + timedelta(days=days_ahead)
-            result["date"] = target_date
-            result["date_str"] = target_date.strftime("%Y-%m-%d")
-            break
-
-    # Поиск дат (число + месяц)
-    date_match = re.search(
-        r"(\d{1,2})(?:\s*[-.]?\s*го)?\s*(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)?",
-        text
-    )
-    if date_match:
-        day = int(date_match.group(1))
-        month_name = date_match.group(2)
-
-        month_map = {
-            "января": 1, "февраля": 2, "марта": 3, "апреля": 4,
-            "мая": 5, "июня": 6, "июля": 7, "августа": 8,
-            "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12
-        }
-
-        if month_name:
-            month = month_map.get(month_name)
-        else:
-            month = reference_date.month
-
-        year = reference_date.year
-        try:
-            target_date = datetime(year, month, day).date()
-            if target_date < reference_date.date():
-                target_date = datetime(year+1, month, day).date()
-            result["date"] = target_date
-            result["date_str"] = target_date.strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-
-    # Поиск времени будильника
-    time_match = re.search(r"\b(\d{1,2})(?:[:.\s](\d{1,2}))?\s*(утра|вечера|ночи|дня)?\b", text)
-    if time_match:
-        hour = int(time_match.group(1))
-        minute = int(time_match.group(2)) if time_match.group(2) else 0
-        period = time_match.group(3)
-
-        # Коррекция времени по периоду дня
-        if period:
-            if period in ["вечера", "ночи"] and 1 <= hour <= 11:
-                hour += 12
-            elif period == "дня" and 1 <= hour <= 11:
-                hour += 12
-            elif period == "утра" and hour == 12:
-                hour = 0
-
-        # Ограничение значений времени
-        hour = max(0, min(23, hour))
-        minute = max(0, min(59, minute))
-
-        result["time"] = f"{hour:02d}:{minute:02d}"
-
-        # Определение даты для будильника
-        alarm_time = datetime.strptime(result["time"], "%H:%M").time()
-        current_time = reference_date.time()
-
-        # Если время уже прошло сегодня - ставим на завтра
-        if alarm_time <= current_time:
-            result["date"] = reference_date + timedelta(days=1)
-        else:
-            result["date"] = reference_date
-
-        result["date_str"] = result["date"].strftime("%Y-%m-%d")
-
-    # Дефолтные значения для периода
-    if not result["date"] and result["period"]:
-        result["date"] = reference_date
-        result["date_str"] = reference_date.strftime("%Y-%m-%d")
-
-    return result
+def find_keywords(text_lower, gazetteer=None):
+    """Лучшее совпадение словаря для каждого вида: {вид: (start, end, значение)}"""
+    best = {}
+    for start, end, (kind, value, priority) in (gazetteer or catalog()).find_all(text_lower):
+        rank = (priority, start)
+        if kind not in best or rank < best[kind][0]:
+            best[kind] = (rank, (start, end, value))
+    return {kind: hit for kind, (_, hit) in best.items()}
 
 def extract_video_title(text, cmd_pos, app_pos):
     """Извлекаем название видео"""
@@ -215,124 +78,233 @@ def extract_video_title(text, cmd_pos, app_pos):
     title = re.sub(r"^(на|в|с|через|приложении?|включи в)\s+|\s+(на|в|с|через|приложении?)$", "", title, flags=re.IGNORECASE)
     return title.strip()
 
-def extract_entities(text):
-    """Собственно извлечение сущностей"""
-    doc = nlp(text.lower())
-    entities = {
-        "room": None, "device": None, "value": None,
-        "application": None, "video_title": None, "city": None,
-        "weather": {"date": None, "period": None},
-        "alarm": {"time": None, "date": None, "period": None}
-    }
-
-    # Извлечение города
-    for ent in doc.ents:
-        if ent.label_ in ["GPE", "LOC"]:
-            entities["city"] = normalize_city(ent.text)
-            break
-
-    # Извлечение комнаты
-    for token in doc:
-        lemma = token.lemma_.lower()
-        if lemma in ROOM_MAP:
-            entities["room"] = ROOM_MAP[lemma]
+# Экстракторы слотов. Каждый заполняет свои слоты и объявляет, какие ресурсы ему нужны:
+#   tokens   — токены spaCy (токенизатор, like_num)
+#   lemmas   — леммы (весь пайплайн, кроме NER); встроенным экстракторам не нужны
+#   ner      — города из NER
+#   keywords — словарь команд и приложений
+#   temporal — временное выражение
+# По интенту выбираются только нужные экстракторы, и spaCy запускается
+# ровно с теми компонентами, которые им нужны.
+EXTRACTORS = []
+
+def extractor(*slots, requires=()):
+    def register(fn):
+        EXTRACTORS.append((slots, frozenset(requires), fn))
+        return fn
+    return register
+
+class ExtractionContext:
+    """Текст запроса и лениво вычисляемые ресурсы для экстракторов"""
+
+    def __init__(self, text, reference_date, tokens=(), cities=()):
+        self.text = text
+        self.reference_date = reference_date
+        self.tokens = tokens
+        self.cities = cities
+        # Один снимок словаря на весь запрос, даже если артефакт подменят посередине
+        self.gazetteer = catalog()
+        self._hits = None
+        self._temporal = None
+
+    @property
+    def hits(self):
+        # Команды и приложения — за один проход по тексту
+        if self._hits is None:
+            with stage("keywords"):
+                self._hits = find_keywords(self.text.lower(), self.gazetteer)
+        return self._hits
+
+    @property
+    def temporal(self):
+        # Временное выражение разбирается один раз для всех слотов
+        if self._temporal is None:
+            with stage("temporal"):
+                self._temporal = self.gazetteer.temporal.parse(self.text, self.reference_date)
+        return self._temporal
+
+@extractor("city", requires=("ner",))
+def extract_city(ctx, entities):
+    if ctx.cities:
+        with stage("city"):
+            entities["city"] = normalize_city(ctx.cities[0][1])
+
+@extractor("room", "device", requires=("tokens",))
+def extract_room_device(ctx, entities):
+    # Словоформы комнат и устройств уже в словаре, леммы spaCy не нужны
+    for _, _, _, token_text in ctx.tokens:
+        for kind, value, _ in ctx.gazetteer.lookup(token_text):
+            if kind in ("room", "device") and entities[kind] is None:
+                entities[kind] = value
+        if entities["room"] is not None and entities["device"] is not None:
             break
 
-    # Извлечение устройства
-    for token in doc:
-        lemma = token.lemma_.lower()
-        for dev_key, dev_list in DEVICES_MAP.items():
-            if lemma in dev_list:
-                entities["device"] = dev_key
-                break
-        if entities["device"]:
-            break
-
-    # Извлечение числового значения
-    for token in doc:
-        if token.like_num:
-            entities["value"] = token.text
-            break
-
-    # Поиск приложений и видео
-    text_lower = text.lower()
-    cmd_match = None
-    app_match = None
-
-    # Поиск команды для видео
-    for cmd in VIDEO_CMDS:
-        match = re.search(rf"\b{re.escape(cmd)}\b", text_lower)
-        if match:
-            cmd_match = (match.start(), match.end())
-            break
-
-    # Поиск приложения
-    app_entries = []
-    for app_name, variants in APP_MAP.items():
-        for variant in variants:
-            app_entries.append((app_name, variant))
-    app_entries.sort(key=lambda x: len(x[1]), reverse=True)
-
-    for app_name, variant in app_entries:
-        match = re.search(rf"\b{re.escape(variant)}\b", text_lower)
-        if match:
-            app_match = (match.start(), match.end())
-            entities["application"] = app_name
+@extractor("value", requires=("tokens",))
+def extract_value(ctx, entities):
+    for _, _, like_num, token_text in ctx.tokens:
+        if like_num:
+            entities["value"] = token_text
             break
 
+@extractor("application", "video_title", requires=("keywords",))
+def extract_media(ctx, entities):
+    cmd_match = ctx.hits.get("video_cmd")
+    app_match = ctx.hits.get("app")
+    if app_match:
+        entities["application"] = app_match[2]
     # Извлечение названия видео
     if cmd_match and app_match:
-        entities["video_title"] = extract_video_title(text, cmd_match, app_match)
-
-    # Погода
-    is_weather_query = any(
-        re.search(rf"\b{re.escape(cmd)}\b", text.lower())
-        for cmd in WEATHER_CMDS
-    )
-
-    if is_weather_query:
-        time_data = parse_datetime(text)
-        entities["weather"] = {
-            "date": time_data["date_str"],
-            "period": time_data["period"]
-        }
-        # Для периодов без указания даты используем сегодня
-        if not time_data["date_str"] and time_data["period"]:
-            entities["weather"]["date"] = datetime.now().strftime("%Y-%m-%d")
-
-    # Обработка будильников
-    is_alarm_query = any(
-        re.search(rf"\b{re.escape(cmd)}\b", text.lower())
-        for cmd in ALARM_CMDS
-    )
-
-    if is_alarm_query:
-        time_data = parse_datetime(text)
-        entities["alarm"] = {
-            "time": time_data["time"],
-            "date": time_data["date_str"],
-            "period": time_data["period"]
+        entities["video_title"] = extract_video_title(ctx.text, cmd_match, app_match)
+
+@extractor("weather", requires=("keywords", "temporal"))
+def extract_weather(ctx, entities):
+    if "weather_cmd" not in ctx.hits:
+        return
+    time_data = ctx.temporal
+    entities["weather"] = {
+        "date": time_data.date_str,
+        "period": time_data.period
+    }
+    # Для периодов без указания даты используем сегодня
+    if not time_data.date_str and time_data.period:
+        entities["weather"]["date"] = ctx.reference_date.strftime("%Y-%m-%d")
+
+@extractor("alarm", requires=("keywords", "temporal"))
+def extract_alarm(ctx, entities):
+    if "alarm_cmd" not in ctx.hits:
+        return
+    time_data = ctx.temporal
+    entities["alarm"] = {
+        "time": time_data.time,
+        "date": time_data.date_str,
+        "period": time_data.period
+    }
+    # Если указан период, но не время - устанавливаем дефолтное время
+    if not time_data.time and time_data.period:
+        default_times = {
+            "утро": "08:00",
+            "день": "13:00",
+            "вечер": "18:00",
+            "ночь": "23:00"
         }
-        # Если указан период, но не время - устанавливаем дефолтное время
-        if not time_data["time"] and time_data["period"]:
-            default_times = {
-                "утро": "08:00",
-                "день": "13:00",
-                "вечер": "18:00",
-                "ночь": "23:00"
-            }
-            entities["alarm"]["time"] = default_times.get(time_data["period"], "08:00")
+        entities["alarm"]["time"] = default_times.get(time_data.period, "08:00")
+
+# Слоты, которые имеют смысл для интента; для неизвестного интента
+# (и интента ниже порога уверенности) извлекаются все слоты
+INTENT_SLOTS = {
+    "turn_on_light": {"room", "device", "value"},
+    "turn_off_light": {"room", "device", "value"},
+    "set_temperature": {"room", "device", "value"},
+    "turn_on_conditioner": {"room", "device", "value"},
+    "turn_off_conditioner": {"room", "device", "value"},
+    "play_music": {"room", "application", "video_title"},
+    "stop_music": {"room", "application"},
+    # Число в value дублирует время, но для «через 30 минут» или «в 14 часов»
+    # другого слота с ним нет
+    "weather_query": {"city", "weather", "value"},
+    "set_alarm": {"alarm", "value"},
+    "turn_on_tv": {"room", "device", "value"},
+    "turn_off_tv": {"room", "device", "value"},
+    "tv_channel_switch": {"room", "device", "value"},
+    "tv_android": {"room", "device", "application", "video_title"},
+}
 
+_plans = {}
+
+def extraction_plan(intent=None):
+    """(экстракторы, нужные ресурсы) для интента; None — все слоты"""
+    plan = _plans.get(intent)
+    if plan is None:
+        slots = INTENT_SLOTS.get(intent)
+        chosen = [fn for names, _, fn in EXTRACTORS if slots is None or slots.intersection(names)]
+        requires = frozenset().union(*(req for names, req, fn in EXTRACTORS if fn in chosen))
+        plan = _plans[intent] = (chosen, requires)
+    return plan
+
+def spacy_options(requires):
+    """Как запускать spaCy: None — не нужен, "tokens" — только токенизатор, иначе список отключаемых компонентов"""
+    if "ner" in requires:
+        return []
+    if "lemmas" in requires:
+        return ["ner"]
+    if "tokens" in requires:
+        return "tokens"
+    return None
+
+def parse_texts(texts, requires, batch_size=64):
+    """spaCy-документы (или None) для текстов в нижнем регистре"""
+    options = spacy_options(requires)
+    if options is None:
+        return [None] * len(texts)
+    nlp = get_nlp()
+    if options == "tokens":
+        return [nlp.make_doc(text) for text in texts]
+    if len(texts) == 1:
+        return [nlp(texts[0], disable=options)]
+    return list(nlp.pipe(texts, batch_size=batch_size, disable=options))
+
+def extract_entities(text, reference_date=None, intent=None):
+    """Собственно извлечение сущностей; intent ограничивает набор слотов"""
+    _, requires = extraction_plan(intent)
+    with stage("spacy"):
+        doc = parse_texts([text.lower()], requires)[0]
+    return entities_from_doc(doc, text, reference_date, intent)
+
+def extract_entities_batch(texts, batch_size=64, reference_date=None, intents=None):
+    """Извлечение сущностей для списка текстов через nlp.pipe"""
+    if reference_date is None:
+        reference_date = datetime.now()
+    if intents is None:
+        intents = [None] * len(texts)
+
+    # Тексты с одинаковым набором компонентов spaCy разбираются одним nlp.pipe
+    groups = {}
+    for i, intent in enumerate(intents):
+        groups.setdefault(extraction_plan(intent)[1], []).append(i)
+    docs = [None] * len(texts)
+    with stage("spacy"):
+        for requires, idx in groups.items():
+            parsed = parse_texts([texts[i].lower() for i in idx], requires, batch_size)
+            for i, doc in zip(idx, parsed):
+                docs[i] = doc
+    return [entities_from_doc(doc, text, reference_date, intent)
+            for doc, text, intent in zip(docs, texts, intents)]
+
+def entities_from_doc(doc, text, reference_date=None, intent=None):
+    """Извлечение сущностей из уже разобранного spaCy-документа (None, если spaCy не нужен)"""
+    with stage("entities"):
+        tokens, cities = token_features(doc) if doc is not None else ((), ())
+        return entities_from_features(tokens, cities, text, reference_date, intent)
+
+def token_features(doc):
+    """
+    Всё, что экстракторам нужно от spaCy-документа:
+    [(начало, лемма, похоже на число, текст)] по токенам и [(начало, текст)] городов из NER
+    """
+    tokens = [(token.idx, token.lemma_.lower(), token.like_num, token.text) for token in doc]
+    cities = [(ent.start_char, ent.text) for ent in doc.ents if ent.label_ in ("GPE", "LOC")]
+    return tokens, cities
+
+def entities_from_features(tokens, cities, text, reference_date=None, intent=None):
+    """Извлечение сущностей по признакам токенов (см. token_features)"""
+    if reference_date is None:
+        reference_date = datetime.now()
+    entities = {
+        "room": None, "device": None, "value": None,
+        "application": None, "video_title": None, "city": None,
+        "weather": {"date": None, "period": None},
+        "alarm": {"time": None, "date": None, "period": None}
+    }
+    ctx = ExtractionContext(text, reference_date, tokens, cities)
+    for fn in extraction_plan(intent)[0]:
+        fn(ctx, entities)
     return entities
 
 # Оценка вероятности намерения через косинусное сходство
 def intent_confidence(text, intent_keywords):
-    doc = nlp(text.lower())
-    max_score = 0.0
-    for kw in intent_keywords:
-        kw_doc = nlp(kw)
-        sim = doc.similarity(kw_doc)
-        if sim > max_score:
-            max_score = sim
-    return max_score
+    return get_scorer(intent_keywords).score(text)[None]
 
+def intent_confidence_batch(texts, intent_keywords):
+    """Сходство каждого текста с ключевыми словами всех интентов: [{интент: сходство}]"""
+    scorer = get_scorer(intent_keywords)
+    return [dict(zip(scorer.intents, map(float, row))) for row in scorer.score_batch(texts)]
@@ -0,0 +1,304 @@
+"""
+Точность против задержки: интенты — стратифицированный k-fold по data.csv,
+сущности — по размеченному entities_gold.jsonl.
+
+Фолды обучаются и проверяются параллельно в отдельных процессах. На каждом фолде
+базовая модель дообучается тем же рецептом, что и в train_finetune.py (Trainer,
+ранняя остановка по accuracy); для ранней остановки из train-части фолда
+откладываются 20%, test-часть в обучении не участвует. Test-часть прогоняется через
+все сочетания движков и бэкендов (--engines, --backends):
+  head      дообученная голова, как server.predict_intent
+  cascade   правила cascade.py перед головой
+  index     индекс эмбеддингов из train-части, энкодер — модель фолда (бэкенд не важен)
+
+Сущности проверяются в двух режимах: слоты по интенту из разметки
+(как при INTENT_CONDITIONED_ENTITIES) и все слоты.
+
+  python evaluate.py --folds 5 --jobs 5
+  python evaluate.py --engines head cascade --backends torch torch-int8 onnx-int8
+  python evaluate.py --skip-intents                 # только сущности, без обучения
+
+Строка разметки сущностей: {"text", "intent", "now", "entities"}; "now" — опорная дата
+для «завтра», в "entities" перечислены только заполненные слоты, вложенные — как в
+ответе /nlp. Задержка — один текст за вызов, как в /nlp. Отчёт сохраняется в --output.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+ENGINES = ["head", "cascade", "index"]
+ENTITY_MODES = ["intent", "all"]
+WARMUP_TEXTS = 5
+
+
+def fine_tune(train, labels, config, model_dir):
+    """Дообучение по рецепту train_finetune.train; отложенная часть — для ранней остановки"""
+    from datasets import Dataset
+    from sklearn.model_selection import train_test_split
+    from transformers import AutoTokenizer
+
+    import train_finetune
+
+    label2id = {l: i for i, l in enumerate(labels)}
+    fit, holdout = train_test_split(train, test_size=0.2, random_state=config["seed"],
+                                    stratify=[l for _, l in train])
+    tokenizer = AutoTokenizer.from_pretrained(config["base_model"])
+
+    def dataset(pairs):
+        data = Dataset.from_dict({"text": [t for t, _ in pairs], "label_id": [label2id[l] for _, l in pairs]})
+        return train_finetune.as_model_inputs(train_finetune.encode(data, tokenizer))
+
+    checkpoints = os.path.join(model_dir, "checkpoints")
+    model = train_finetune.train(tokenizer, dataset(fit), dataset(holdout), len(labels), output_dir=checkpoints,
+                                 model_name=config["base_model"], dataloader_num_workers=0)
+    model.save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    shutil.rmtree(checkpoints, ignore_errors=True)
+
+
+def prepare_backend(name, model_dir):
+    """Загружает бэкенд, при необходимости собрав для него файлы весов"""
+    from backends import BACKENDS, ONNX_FILE, export_onnx, load_backend
+
+    if name.startswith("onnx") and not os.path.exists(os.path.join(model_dir, ONNX_FILE)):
+        export_onnx(model_dir)
+    dtype = getattr(BACKENDS.get(name), "weights_dtype", "fp32")
+    if dtype != "fp32":
+        from mmap_weights import convert
+        convert(model_dir, dtype)
+    return load_backend(name, model_dir)
+
+
+def score(predict, texts, labels):
+    """Точность, взвешенный F1 (как в train_finetune.py) и задержка одного вызова"""
+    from sklearn.metrics import f1_score
+
+    for text in texts[:WARMUP_TEXTS]:
+        predict(text)
+    preds, latencies = [], []
+    for text in texts:
+        start = time.perf_counter()
+        preds.append(predict(text))
+        latencies.append(time.perf_counter() - start)
+    return {
+        "accuracy": float(np.mean([p == l for p, l in zip(preds, labels)])),
+        "f1": float(f1_score(labels, preds, average="weighted", zero_division=0)),
+        "latencies": latencies,
+    }
+
+
+def run_fold(fold, train, test, labels, config):
+    """Обучение и проверка одного фолда; выполняется в отдельном процессе"""
+    import torch
+
+    from cascade import Cascade
+
+    torch.set_num_threads(config["threads"])
+    model_dir = os.path.join(config["workdir"], f"fold{fold}")
+    fine_tune(train, labels, config, model_dir)
+
+    texts = [t for t, _ in test]
+    gold = [l for _, l in test]
+    rows = []
+    for backend_name in config["backends"]:
+        engines = [e for e in config["engines"] if e != "index"]
+        if not engines:
+            break
+        backend = prepare_backend(backend_name, model_dir)
+
+        def predict_batch(batch):
+            return [(labels[int(row.argmax())], float(row.max())) for row in backend.predict_proba(batch)]
+
+        def predict(text):
+            return predict_batch([text])[0]
+
+        cascade = Cascade(predict, predict_batch)
+        run = {"head": lambda t: predict(t)[0], "cascade": lambda t: cascade.predict(t)[0]}
+        for engine in engines:
+            rows.append({"fold": fold, "engine": engine, "backend": backend_name,
+                         **score(run[engine], texts, gold)})
+        del backend
+
+    if "index" in config["engines"]:
+        from embedding_index import IntentIndex
+
+        index = IntentIndex.build(os.path.join(model_dir, "index"), [t for t, _ in train],
+                                  [l for _, l in train], model_dir)
+        rows.append({"fold": fold, "engine": "index", "backend": "-",
+                     **score(lambda t: index.predict(t)[0], texts, gold)})
+    return rows
+
+
+def evaluate_intents(args):
+    import pandas as pd
+    from sklearn.model_selection import StratifiedKFold
+
+    df = pd.read_csv(args.data).dropna()
+    texts = [t.lower() for t in df["text"]]
+    labels = list(df["label"])
+    label_order = list(df["label"].unique())
+    folds = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed).split(texts, labels)
+
+    workdir = args.models_dir or tempfile.mkdtemp(prefix="evaluate_")
+    config = {
+        "base_model": args.base_model, "seed": args.seed, "threads": args.threads, "workdir": workdir,
+        "engines": args.engines, "backends": args.backends,
+    }
+    # spawn: у каждого фолда чистый torch со своим числом потоков
+    os.environ["INFERENCE_THREADS"] = str(args.threads)
+    rows = []
+    with ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(run_fold, fold,
+                        [(texts[i], labels[i]) for i in train_idx],
+                        [(texts[i], labels[i]) for i in test_idx],
+                        label_order, config)
+            for fold, (train_idx, test_idx) in enumerate(folds)
+        ]
+        for future in futures:
+            rows.extend(future.result())
+    print(f"Модели фолдов: {workdir}")
+    return summarize_intents(rows)
+
+
+def summarize_intents(rows):
+    """Среднее и разброс по фолдам; задержки всех фолдов вместе"""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["engine"], row["backend"]), []).append(row)
+    summary = []
+    for (engine, backend), group in groups.items():
+        latencies = np.concatenate([r["latencies"] for r in group]) * 1000
+        acc = [r["accuracy"] for r in group]
+        f1 = [r["f1"] for r in group]
+        summary.append({
+            "engine": engine, "backend": backend, "folds": len(group),
+            "accuracy": round(float(np.mean(acc)), 4), "accuracy_std": round(float(np.std(acc)), 4),
+            "f1": round(float(np.mean(f1)), 4), "f1_std": round(float(np.std(f1)), 4),
+            "mean_ms": round(float(latencies.mean()), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        })
+    return summary
+
+
+def flatten(entities, prefix=""):
+    """{"weather": {"date": ...}} -> {"weather.date": ...}, только заполненные слоты"""
+    flat = {}
+    for key, value in entities.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif value is not None:
+            flat[prefix + key] = value
+    return flat
+
+
+def evaluate_entities(gold_path):
+    from cache import normalize_text
+    from entity_extractor import extract_entities
+
+    with open(gold_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    summary = []
+    for mode in ENTITY_MODES:
+        for record in records[:WARMUP_TEXTS]:
+            extract_entities(normalize_text(record["text"]), datetime.fromisoformat(record["now"]))
+        tp = fp = fn = exact = 0
+        slots = {}
+        latencies = []
+        for record in records:
+            text = normalize_text(record["text"])
+            now = datetime.fromisoformat(record["now"])
+            intent = record["intent"] if mode == "intent" else None
+            start = time.perf_counter()
+            predicted = flatten(extract_entities(text, now, intent))
+            latencies.append(time.perf_counter() - start)
+
+            gold = flatten(record["entities"])
+            exact += predicted == gold
+            for slot in set(gold) | set(predicted):
+                counts = slots.setdefault(slot, [0, 0, 0])
+                if predicted.get(slot) == gold.get(slot):
+                    counts[0] += 1
+                    continue
+                if slot in predicted:
+                    counts[1] += 1
+                if slot in gold:
+                    counts[2] += 1
+        for counts in slots.values():
+            tp, fp, fn = tp + counts[0], fp + counts[1], fn + counts[2]
+        latencies = np.array(latencies) * 1000
+        summary.append({
+            "mode": mode, "texts": len(records),
+            **prf(tp, fp, fn),
+            "exact": round(exact / len(records), 4) if records else 0.0,
+            "mean_ms": round(float(latencies.mean()), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "slots": {slot: prf(*counts) for slot, counts in sorted(slots.items())},
+        })
+    return summary
+
+
+def prf(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="k-fold оценка интентов и оценка сущностей по разметке")
+    parser.add_argument("--data", default="data.csv")
+    parser.add_argument("--gold", default="entities_gold.jsonl", help="разметка сущностей")
+    parser.add_argument("--base-model", default="cointegrated/rubert-tiny")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=0, help="параллельных фолдов (по умолчанию min(folds, cpu))")
+    parser.add_argument("--threads", type=int, default=0, help="потоков torch на фолд (по умолчанию cpu/jobs)")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES)
+    parser.add_argument("--backends", nargs="+", default=["torch"], help="см. backends.BACKENDS")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--models-dir", help="куда сохранять модели фолдов (по умолчанию временный каталог)")
+    parser.add_argument("--skip-intents", action="store_true")
+    parser.add_argument("--skip-entities", action="store_true")
+    parser.add_argument("--output", default="eval_report.json")
+    args = parser.parse_args()
+    if args.jobs <= 0:
+        args.jobs = min(args.folds, cpus)
+    if args.threads <= 0:
+        args.threads = max(1, cpus // args.jobs)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+    }
+    if not args.skip_intents:
+        report["intents"] = evaluate_intents(args)
+        print(f"Интенты, {args.folds} фолдов:")
+        print(f"{'engine':8s} {'backend':16s} {'accuracy':>15s} {'F1':>15s} {'mean ms':>8s} {'p99 ms':>8s}")
+        for r in report["intents"]:
+            print(f"{r['engine']:8s} {r['backend']:16s} {r['accuracy']:>8.4f} ±{r['accuracy_std']:.3f} "
+                  f"{r['f1']:>8.4f} ±{r['f1_std']:.3f} {r['mean_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+    if not args.skip_entities:
+        report["entities"] = evaluate_entities(args.gold)
+        print(f"Сущности, {args.gold}:")
+        print(f"{'слоты':8s} {'precision':>9s} {'recall':>7s} {'F1':>7s} {'exact':>7s} {'mean ms':>8s} {'p99 ms':>8s}")
+        for r in report["entities"]:
+            print(f"{r['mode']:8s} {r['precision']:>9.4f} {r['recall']:>7.4f} {r['f1']:>7.4f} "
+                  f"{r['exact']:>7.4f} {r['mean_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт сохранён в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Словари команд, приложений, комнат и устройств.
+
+Исходные данные — gazetteer.json. Компилятор превращает их в бинарный
+артефакт gazetteer.bin: хеш-таблица с открытой адресацией «фраза -> записи»
+плюс пул строк. Для комнат и устройств заранее добавляются все словоформы
+из pymorphy2, поэтому во время работы лемматизация для них не нужна.
+
+Артефакт открывается через mmap: процессы делят его страницы, а стоимость
+поиска не зависит от размера словаря — на каждую позицию в тексте
+приходится не больше max_words обращений к таблице.
+
+  python gazetteer.py compile                  # gazetteer.json -> gazetteer.bin
+  python gazetteer.py bench --sizes 100 10000  # стоимость поиска от размера словаря
+
+Сервер перечитывает артефакт, когда файл меняется: компилятор пишет
+новый файл рядом и атомарно переименовывает его.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from cache import lru_stats
+from temporal import TemporalParser
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_PATH = os.environ.get("GAZETTEER_SOURCE", os.path.join(BASE_DIR, "gazetteer.json"))
+ARTIFACT_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(BASE_DIR, "gazetteer.bin"))
+CHECK_INTERVAL_S = 1.0
+# Результатов lookup в памяти на артефакт: слова в запросах повторяются; 0 — без кэша
+LOOKUP_CACHE_SIZE = 50000
+
+MAGIC = b"GZT1"
+SLOT = struct.Struct("<II")      # хеш, номер ключа + 1 (0 — пустой слот)
+KEY = struct.Struct("<IIII")     # смещение строки, длина, первая запись, число записей
+ENTRY = struct.Struct("<IIII")   # вид, приоритет, смещение значения, длина
+# Та же классификация символов, что у \w: совпадение только на границах слов
+WORD_RE = re.compile(r"\w+")
+
+
+def load_source(path=SOURCE_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def source_entries(data, inflect=None):
+    """
+    [(фраза, вид, значение, приоритет)] в порядке добавления.
+    Меньший приоритет важнее; при равном побеждает самое раннее вхождение в тексте.
+    """
+    entries = []
+    for priority, cmd in enumerate(data["video_commands"]):
+        entries.append((cmd, "video_cmd", cmd, priority))
+
+    # Более длинные варианты приложений имеют приоритет
+    app_entries = [(app_name, variant) for app_name, variants in data["apps"].items() for variant in variants]
+    app_entries.sort(key=lambda x: len(x[1]), reverse=True)
+    for priority, (app_name, variant) in enumerate(app_entries):
+        entries.append((variant, "app", app_name, priority))
+
+    for cmd in data["weather_commands"]:
+        entries.append((cmd, "weather_cmd", cmd, 0))
+    for cmd in data["alarm_commands"]:
+        entries.append((cmd, "alarm_cmd", cmd, 0))
+
+    for section, kind in (("rooms", "room"), ("devices", "device")):
+        forms = {}
+        # Явные варианты важнее словоформ; при пересечении побеждает первый ключ
+        for value, variants in data[section].items():
+            for variant in variants:
+                forms.setdefault(variant, value)
+        if inflect is not None and section in data.get("inflect", ()):
+            for value, variants in data[section].items():
+                for variant in variants:
+                    for form in inflect(variant, {value, *variants}):
+                        forms.setdefault(form, value)
+        entries.extend((form, kind, value, 0) for form, value in forms.items())
+    return entries
+
+
+def pymorphy_inflector():
+    """
+    Все словоформы однословного варианта (и написание через «е» вместо «ё»).
+    Склоняются только известные словарю существительные, чья нормальная форма —
+    сам вариант, другой вариант того же значения или значение: иначе сленг
+    и сокращения дали бы чужие слова («теле» -> «тело», «тела», «телу»).
+    """
+    from nlp_pipeline import get_morph
+
+    morph = get_morph()
+
+    def inflect(word, allowed):
+        if " " in word:
+            return []
+        allowed = {w.replace("ё", "е") for w in allowed}
+        for parse in morph.parse(word):
+            if parse.is_known and parse.tag.POS == "NOUN" and parse.normal_form.replace("ё", "е") in allowed:
+                break
+        else:
+            return [word.replace("ё", "е")]
+        forms = []
+        for form in parse.lexeme:
+            forms.append(form.word)
+            forms.append(form.word.replace("ё", "е"))
+        return forms
+    return inflect
+
+
+def load_inflector():
+    """(инфлектор, None) или (None, текст ошибки), если pymorphy2 не работает"""
+    try:
+        return pymorphy_inflector(), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def compile_gazetteer(source=SOURCE_PATH, output=ARTIFACT_PATH, inflect=True):
+    """Компилирует gazetteer.json в артефакт; возвращает число фраз"""
+    with open(source, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+
+    inflector = inflect_error = None
+    if inflect and data.get("inflect"):
+        inflector, inflect_error = load_inflector()
+        if inflect_error:
+            print(f"Словоформы pymorphy2 не добавлены ({inflect_error}); "
+                  "комнаты и устройства ищутся только по явным вариантам", file=sys.stderr)
+
+    kinds, keys = [], {}
+    for phrase, kind, value, priority in source_entries(data, inflector):
+        if kind not in kinds:
+            kinds.append(kind)
+        keys.setdefault(phrase, []).append((kinds.index(kind), priority, value))
+
+    strings = bytearray()
+    interned = {}
+
+    def intern(text):
+        if text not in interned:
+            encoded = text.encode("utf-8")
+            interned[text] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return interned[text]
+
+    n_slots = 1 << max(4, (2 * len(keys) - 1).bit_length())   # заполнение не больше 1/2
+    slots = [(0, 0)] * n_slots
+    key_table, entry_table = bytearray(), bytearray()
+    n_entries = 0
+    for key_id, (phrase, payloads) in enumerate(keys.items()):
+        offset, length = intern(phrase)
+        key_table += KEY.pack(offset, length, n_entries, len(payloads))
+        for kind_id, priority, value in payloads:
+            entry_table += ENTRY.pack(kind_id, priority, *intern(value))
+            n_entries += 1
+        h = zlib.crc32(phrase.encode("utf-8"))
+        i = h & (n_slots - 1)
+        while slots[i][1]:
+            i = (i + 1) & (n_slots - 1)
+        slots[i] = (h, key_id + 1)
+    slot_table = b"".join(SLOT.pack(*s) for s in slots)
+
+    header = {
+        "source_sha256": hashlib.sha256(raw).hexdigest(),
+        "inflected": inflector is not None,
+        # Словоформы запрошены, но pymorphy2 не сработал: is_stale пересоберёт артефакт
+        "inflect_error": inflect_error,
+        "kinds": kinds,
+        "n_slots": n_slots,
+        "n_keys": len(keys),
+        "n_entries": n_entries,
+        "max_words": max(len(WORD_RE.findall(p)) for p in keys),
+        # Первые слова многословных фраз: с остальных слов ищутся только однословные
+        "phrase_heads": sorted({WORD_RE.findall(p)[0] for p in keys if len(WORD_RE.findall(p)) > 1}),
+        "max_bytes": max(len(p.encode("utf-8")) for p in keys),
+        "temporal": {name: data[name] for name in ("time_periods", "relative_days", "days_of_week")},
+    }
+    sections = [slot_table, bytes(key_table), bytes(entry_table), bytes(strings)]
+    header_raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_raw += b" " * (-(len(MAGIC) + 4 + len(header_raw)) % 8)
+
+    # Устаревший артефакт пересобирает каждый процесс, импортировавший словарь
+    # (воркеры, фолды evaluate.py, annotate.py): у каждого свой временный файл,
+    # os.replace атомарен, выигрывает любой из одинаковых результатов
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(output) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header_raw)) + header_raw)
+            for section in sections:
+                f.write(section)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, output)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(keys)
+
+
+class CompiledGazetteer:
+    """Артефакт gazetteer.bin, открытый через mmap"""
+
+    def __init__(self, path=ARTIFACT_PATH, cache_size=LOOKUP_CACHE_SIZE):
+        with open(path, "rb") as f:
+            self._mm = mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:4] != MAGIC:
+            raise ValueError(f"{path}: не артефакт словаря")
+        header_len = struct.unpack_from("<I", mm, 4)[0]
+        self.header = header = json.loads(mm[8:8 + header_len])
+        self.path = path
+        self.kinds = header["kinds"]
+        self.max_words = header["max_words"]
+        self.max_bytes = header["max_bytes"]
+        self.phrase_heads = frozenset(header["phrase_heads"])
+        self._mask = header["n_slots"] - 1
+        self._slots = 8 + header_len
+        self._keys = self._slots + header["n_slots"] * SLOT.size
+        self._entries = self._keys + header["n_keys"] * KEY.size
+        self._strings = self._entries + header["n_entries"] * ENTRY.size
+        temporal = header["temporal"]
+        self.temporal = TemporalParser(temporal["time_periods"], temporal["relative_days"], temporal["days_of_week"])
+        if cache_size:
+            self.lookup = functools.lru_cache(cache_size)(self._probe)
+
+    def __len__(self):
+        return self.header["n_keys"]
+
+    def lookup(self, phrase):
+        """((вид, значение, приоритет), ...) для фразы целиком"""
+        return self._probe(phrase)
+
+    def _probe(self, phrase):
+        data = phrase.encode("utf-8")
+        h = zlib.crc32(data)
+        mm, i = self._mm, h & self._mask
+        while True:
+            slot_hash, key_id = SLOT.unpack_from(mm, self._slots + i * SLOT.size)
+            if not key_id:
+                return ()
+            if slot_hash == h:
+                offset, length, first, count = KEY.unpack_from(mm, self._keys + (key_id - 1) * KEY.size)
+                start = self._strings + offset
+                if mm[start:start + length] == data:
+                    return tuple(self._entry(first + n) for n in range(count))
+            i = (i + 1) & self._mask
+
+    def _entry(self, n):
+        kind, priority, offset, length = ENTRY.unpack_from(self._mm, self._entries + n * ENTRY.size)
+        start = self._strings + offset
+        return self.kinds[kind], self._mm[start:start + length].decode("utf-8"), priority
+
+    def lookup_stats(self):
+        return lru_stats(self.lookup) if hasattr(self.lookup, "cache_info") else None
+
+    def find_all(self, text):
+        """Все совпадения как (start, end, (вид, значение, приоритет)) в порядке позиции"""
+        words = [m.span() for m in WORD_RE.finditer(text)]
+        hits = []
+        for i, (start, first_end) in enumerate(words):
+            span = self.max_words if text[start:first_end] in self.phrase_heads else 1
+            for _, end in words[i:i + span]:
+                if end - start > self.max_bytes:
+                    break
+                for payload in self.lookup(text[start:end]):
+                    hits.append((start, end, payload))
+        return hits
+
+
+class GazetteerStore:
+    """
+    Текущий артефакт словаря. Раз в check_interval секунд при обращении
+    проверяется mtime файла; изменившийся артефакт открывается и подменяет
+    текущий одним присваиванием — запросы, уже получившие старый, дорабатывают на нём.
+    """
+
+    def __init__(self, path=ARTIFACT_PATH, source=SOURCE_PATH, check_interval=CHECK_INTERVAL_S):
+        self.path = path
+        self.check_interval = check_interval
+        if source and is_stale(path, source):
+            compile_gazetteer(source, path)
+        self._mtime = os.stat(path).st_mtime_ns
+        self.current = CompiledGazetteer(path)
+        self._next_check = time.monotonic() + check_interval
+        self.reloads = 0
+
+    def get(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._refresh()
+        return self.current
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            self.current = CompiledGazetteer(self.path)
+            self.reloads += 1
+        except (OSError, ValueError) as e:
+            print(f"Артефакт словаря {self.path} не загружен: {e}", file=sys.stderr, flush=True)
+
+
+def is_stale(path, source):
+    """
+    Артефакта нет, он собран из другой версии исходника или без словоформ из-за
+    ошибки pymorphy2, которая с тех пор исчезла или сменилась. Та же ошибка не
+    повод пересобирать: иначе каждый запуск менял бы файл и все процессы его перечитывали.
+    """
+    if not os.path.exists(path):
+        return True
+    try:
+        header = CompiledGazetteer(path, cache_size=0).header
+    except ValueError:
+        return True
+    if "inflected" not in header:
+        return True
+    with open(source, "rb") as f:
+        if header.get("source_sha256") != hashlib.sha256(f.read()).hexdigest():
+            return True
+    return bool(header.get("inflect_error")) and header["inflect_error"] != load_inflector()[1]
+
+
+def bench(sizes, repeat=2000):
+    """Время find_all на одной фразе для словарей разного размера (без кэша lookup)"""
+    data = load_source()
+    text = "включи маша и медведь на ютуб музик в спальне"
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            synthetic = dict(data, apps=dict(data["apps"], **{f"app{i}": [f"приложение номер {i}"] for i in range(size)}))
+            source, output = os.path.join(tmp, "g.json"), os.path.join(tmp, "g.bin")
+            with open(source, "w", encoding="utf-8") as f:
+                json.dump(synthetic, f, ensure_ascii=False)
+            compile_gazetteer(source, output, inflect=False)
+            gazetteer = CompiledGazetteer(output, cache_size=0)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                gazetteer.find_all(text)
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f"фраз {len(gazetteer):>7d}  файл {os.path.getsize(output) / 1024:>8.1f} KB  "
+                  f"find_all {elapsed * 1e6:.2f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Компиляция словарей в gazetteer.bin")
+    sub = parser.add_subparsers(dest="command", required=True)
+    comp = sub.add_parser("compile")
+    comp.add_argument("--source", default=SOURCE_PATH)
+    comp.add_argument("--output", default=ARTIFACT_PATH)
+    comp.add_argument("--no-inflect", action="store_true", help="без словоформ pymorphy2")
+    b = sub.add_parser("bench")
+    b.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        start = time.perf_counter()
+        count = compile_gazetteer(args.source, args.output, inflect=not args.no_inflect)
+        print(f"{args.output}: {count} фраз, {os.path.getsize(args.output) / 1024:.1f} KB, "
+              f"{time.perf_counter() - start:.2f}s")
+    else:
+        bench(args.sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Лёгкие метрики в формате Prometheus: счётчики и гистограммы задержек по этапам.
+
+Этап замеряется контекстным менеджером stage("forward"). Если для текущего
+запроса включена трассировка (start_trace), длительности этапов дополнительно
+складываются в словарь запроса — для отладочной разбивки в ответе.
+Метрики считаются на процесс; при запуске через serve.py у каждого воркера свои.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Границы корзин в секундах: от 100 мкс до 10 с
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_registry = []
+_collectors = []
+_trace = ContextVar("nlp_trace", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(names, key + (bound,))} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("nlp_requests_total", "HTTP-запросы по эндпоинту и статусу", ("endpoint", "status"))
+STAGE_LATENCY = Histogram("nlp_stage_seconds", "Длительность этапов обработки", ("stage",))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + elapsed
+
+
+def start_trace():
+    """Включает сбор разбивки по этапам для текущего запроса"""
+    trace = {}
+    _trace.set(trace)
+    return trace
+
+
+def stop_trace():
+    _trace.set(None)
+
+
+def merge_trace(stages):
+    """Добавляет к разбивке текущего запроса этапы, выполненные в другом потоке"""
+    trace = _trace.get()
+    if trace is not None:
+        for name, seconds in stages.items():
+            trace[name] = trace.get(name, 0.0) + seconds
+
+
+def format_trace(trace):
+    """Разбивка по этапам в миллисекундах"""
+    return {name: round(seconds * 1000, 3) for name, seconds in trace.items()}
+
+
+def register_collector(fn):
+    """fn() -> [(имя, тип, описание, значение)] — значения, снимаемые в момент экспорта"""
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for fn in _collectors:
+        for name, kind, description, value in fn():
+            lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+"""
+Веса модели в safetensors, отображённые в память.
+
+Обычный from_pretrained читает веса в приватную память каждого процесса.
+Здесь тензоры модели — окна в файл, отображённый через mmap: страницы лежат
+в page cache и общие для всех воркеров, в том числе перезапущенных и
+поднятых после горячей замены модели. Отображение приватное (copy-on-write),
+веса только читаются, поэтому страницы не копируются.
+
+Варианты хранения:
+  fp32  — model.safetensors из save_pretrained как есть
+  bf16  — model.bf16.safetensors, вдвое меньше, вычисления в bf16
+  int8  — model.int8.safetensors, 2D-веса Linear и Embedding в int8 с масштабом
+          на строку; деквантизация на лету при каждом forward
+
+  python mmap_weights.py convert --model ./finetuned_model --dtype int8
+  python mmap_weights.py rss --model ./finetuned_model --workers 3
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+
+WEIGHT_FILES = {
+    "fp32": "model.safetensors",
+    "bf16": "model.bf16.safetensors",
+    "int8": "model.int8.safetensors",
+}
+SCALE_SUFFIX = ".int8_scale"
+# bf16 хранится как uint16 и переинтерпретируется в torch
+NP_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8,
+    "U8": np.uint8, "BOOL": np.bool_,
+}
+DTYPE_CODES = {np.dtype(v): k for k, v in NP_DTYPES.items() if k != "BF16"}
+
+
+def read_header(path):
+    """(заголовок safetensors, смещение начала данных)"""
+    with open(path, "rb") as f:
+        size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(size))
+    header.pop("__metadata__", None)
+    return header, 8 + size
+
+
+def map_arrays(path):
+    """{имя: (код типа, numpy-массив поверх mmap файла)}"""
+    header, data_start = read_header(path)
+    with open(path, "rb") as f:
+        # ACCESS_COPY: страницы общие, пока их никто не пишет, а массивы формально записываемые
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    arrays = {}
+    for name, info in header.items():
+        dtype = np.dtype(NP_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        arr = np.frombuffer(mm, dtype=dtype, count=(end - start) // dtype.itemsize, offset=data_start + start)
+        arrays[name] = (info["dtype"], arr.reshape(info["shape"]))
+    return arrays
+
+
+def write_safetensors(path, arrays):
+    """arrays: {имя: (код типа, numpy-массив)}; тензоры выравниваются по размеру элемента"""
+    order = sorted(arrays, key=lambda n: (-arrays[n][1].dtype.itemsize, n))
+    header, offset = {"__metadata__": {"format": "pt"}}, 0
+    for name in order:
+        code, arr = arrays[name]
+        header[name] = {"dtype": code, "shape": list(arr.shape), "data_offsets": [offset, offset + arr.nbytes]}
+        offset += arr.nbytes
+    raw = json.dumps(header, separators=(",", ":")).encode()
+    raw += b" " * (-len(raw) % 8)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(raw)
+        for name in order:
+            f.write(np.ascontiguousarray(arrays[name][1]).tobytes())
+    os.replace(tmp, path)
+
+
+def to_bf16(arr):
+    """float32 -> биты bfloat16 (uint16) с округлением к ближайшему чётному"""
+    bits = np.ascontiguousarray(arr, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    bits += 0x7FFF + ((bits >> 16) & 1)
+    return (bits >> 16).astype(np.uint16)
+
+
+def quantize_int8(arr):
+    """Симметричная int8-квантизация по строкам: (веса int8, масштаб float32 на строку)"""
+    arr = arr.astype(np.float32)
+    scale = np.abs(arr).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(arr / scale[:, None]), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def convert(model_dir, dtype):
+    """Пишет model.<dtype>.safetensors рядом с model.safetensors"""
+    source = os.path.join(model_dir, WEIGHT_FILES["fp32"])
+    if not os.path.exists(source):
+        raise RuntimeError(
+            f"Файл {source} не найден. Сохраните модель в safetensors:\n"
+            "model.save_pretrained(path, safe_serialization=True)"
+        )
+    out = {}
+    for name, (code, arr) in map_arrays(source).items():
+        if code != "F32":
+            out[name] = (code, arr)
+        elif dtype == "bf16":
+            out[name] = ("BF16", to_bf16(arr))
+        elif dtype == "int8" and arr.ndim == 2 and name.endswith(".weight"):
+            q, scale = quantize_int8(arr)
+            out[name] = ("I8", q)
+            out[name + SCALE_SUFFIX] = ("F32", scale)
+        else:
+            out[name] = (code, arr)
+    path = os.path.join(model_dir, WEIGHT_FILES[dtype])
+    write_safetensors(path, out)
+    return path
+
+
+_int8_modules = None
+
+
+def int8_modules():
+    """Классы Int8Linear и Int8Embedding (torch импортируется лениво)"""
+    global _int8_modules
+    if _int8_modules is None:
+        import torch
+        import torch.nn.functional as F
+
+        class Int8Linear(torch.nn.Module):
+            def __init__(self, linear, qweight, scale):
+                super().__init__()
+                self.in_features, self.out_features = linear.in_features, linear.out_features
+                self.register_buffer("qweight", qweight, persistent=False)
+                self.register_buffer("scale", scale.unsqueeze(1), persistent=False)
+                self.bias = linear.bias
+
+            def forward(self, x):
+                # Деквантизованная копия живёт только на время forward
+                return F.linear(x, self.qweight.to(x.dtype) * self.scale.to(x.dtype), self.bias)
+
+        class Int8Embedding(torch.nn.Module):
+            def __init__(self, embedding, qweight, scale):
+                super().__init__()
+                self.num_embeddings, self.embedding_dim = qweight.shape
+                self.padding_idx = embedding.padding_idx
+                self.register_buffer("qweight", qweight, persistent=False)
+                self.register_buffer("scale", scale.unsqueeze(1), persistent=False)
+
+            def forward(self, ids):
+                return self.qweight[ids].float() * self.scale[ids]
+
+        _int8_modules = {torch.nn.Linear: Int8Linear, torch.nn.Embedding: Int8Embedding}
+    return _int8_modules
+
+
+def load_model(model_dir, dtype="fp32"):
+    """AutoModelForSequenceClassification, чьи веса — окна в отображённый файл"""
+    import torch
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+
+    path = os.path.join(model_dir, WEIGHT_FILES[dtype])
+    if not os.path.exists(path):
+        raise RuntimeError(
+            f"Файл {path} не найден. Подготовьте веса командой:\n"
+            f"python mmap_weights.py convert --model {model_dir} --dtype {dtype}"
+        )
+    model = AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(model_dir))
+
+    arrays = map_arrays(path)
+    state = {}
+    for name, (code, arr) in arrays.items():
+        if name.endswith(SCALE_SUFFIX):
+            continue
+        if code == "BF16":
+            # uint16 в torch.from_numpy поддерживается не во всех версиях
+            tensor = torch.from_numpy(arr.view(np.int16)).view(torch.bfloat16)
+        else:
+            tensor = torch.from_numpy(arr)
+        scale = arrays.get(name + SCALE_SUFFIX)
+        if scale is None:
+            state[name] = tensor
+            continue
+        module_name = name.rsplit(".", 1)[0]
+        module = model.get_submodule(module_name)
+        replacement = int8_modules().get(type(module))
+        if replacement is None:
+            # Редкий случай: квантизован вес модуля без int8-версии — обычная копия
+            state[name] = tensor.float() * torch.from_numpy(scale[1]).unsqueeze(1)
+            continue
+        parent_name, _, child = module_name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, child, replacement(module, tensor, torch.from_numpy(scale[1])))
+
+    # assign=True подставляет сами тензоры из mmap вместо копирования в случайные веса
+    missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+    if missing or unexpected:
+        raise RuntimeError(f"Веса {path} не подходят к модели: нет {missing}, лишние {unexpected}")
+    model.eval()
+    return model
+
+
+def memory_usage():
+    """RSS, PSS и уникальная память (USS) процесса в МБ по /proc/self/smaps_rollup"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "uss_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def _rss_worker(backend_name, model_dir, loaded, done, results):
+    from backends import load_backend
+
+    before = memory_usage()
+    backend = load_backend(backend_name, model_dir)
+    backend.predict_proba(["включи свет на кухне", "какая погода завтра в москве"])
+    loaded.wait()
+    # Замер, когда все воркеры загрузили модель: общие страницы делятся между ними в PSS
+    results.put((os.getpid(), before, memory_usage()))
+    done.wait()
+
+
+def rss_report(model_dir, backends, workers):
+    """Поднимает workers независимых процессов на каждый бэкенд и печатает их память"""
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'бэкенд':18s} {'RSS до':>8s} {'RSS':>8s} {'USS':>8s} {'PSS':>8s}   (МБ на воркер, {workers} воркера)")
+    for name in backends:
+        loaded, done = ctx.Barrier(workers + 1), ctx.Event()
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_rss_worker, args=(name, model_dir, loaded, done, results))
+                 for _ in range(workers)]
+        for p in procs:
+            p.start()
+        loaded.wait()
+        rows = [results.get() for _ in procs]
+        done.set()
+        for p in procs:
+            p.join()
+        mean = {key: np.mean([after[key] for _, _, after in rows]) for key in ("rss_mb", "uss_mb", "pss_mb")}
+        before = np.mean([b["rss_mb"] for _, b, _ in rows])
+        print(f"{name:18s} {before:>8.1f} {mean['rss_mb']:>8.1f} {mean['uss_mb']:>8.1f} {mean['pss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Веса модели через mmap")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="bf16/int8-копия model.safetensors")
+    conv.add_argument("--model", default="./finetuned_model")
+    conv.add_argument("--dtype", choices=["bf16", "int8"], required=True)
+
+    rss = sub.add_parser("rss", help="память воркеров для разных бэкендов")
+    rss.add_argument("--model", default="./finetuned_model")
+    rss.add_argument("--workers", type=int, default=3)
+    rss.add_argument("--backends", nargs="+",
+                     default=["torch", "torch-mmap", "torch-mmap-bf16", "torch-mmap-int8"])
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        path = convert(args.model, args.dtype)
+        print(f"Веса сохранены в {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+    else:
+        rss_report(args.model, args.backends, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Общий реестр тяжёлых NLP-ресурсов: spaCy-пайплайн и MorphAnalyzer.
+
+Ресурсы загружаются лениво при первом обращении, один раз на процесс.
+Из spaCy-модели исключены компоненты, которые экстракторам не нужны:
+лемматизатору нужны tok2vec/morphologizer/attribute_ruler, городам — ner,
+а like_num, is_stop и is_punct — лексические атрибуты без компонентов.
+
+Замер холодного старта и памяти:
+  python nlp_pipeline.py
+"""
+import threading
+
+SPACY_MODEL = "ru_core_news_sm"
+SPACY_EXCLUDE = ["parser", "senter"]
+WARMUP_TEXTS = ["включи свет на кухне", "какая погода завтра в москве"]
+
+_lock = threading.Lock()
+_nlp = None
+_morph = None
+
+
+def get_nlp():
+    """spaCy-пайплайн без лишних компонентов"""
+    global _nlp
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                _nlp = load_spacy(SPACY_MODEL, SPACY_EXCLUDE)
+    return _nlp
+
+
+def get_morph():
+    """Общий MorphAnalyzer"""
+    global _morph
+    if _morph is None:
+        with _lock:
+            if _morph is None:
+                from pymorphy2 import MorphAnalyzer
+                _morph = MorphAnalyzer()
+    return _morph
+
+
+def load_spacy(name, exclude=()):
+    import spacy
+
+    try:
+        return spacy.load(name, exclude=list(exclude))
+    except OSError:
+        # Если модель не установлена — выводим инструкцию
+        raise RuntimeError(
+            f"Модель spaCy '{name}' не установлена. "
+            "Установите её командой:\n"
+            f"python -m spacy download {name}"
+        )
+
+
+def preload(warmup=True):
+    """Загружает все ресурсы заранее; warmup прогоняет несколько текстов"""
+    nlp = get_nlp()
+    morph = get_morph()
+    if warmup:
+        for doc in nlp.pipe(WARMUP_TEXTS):
+            for token in doc:
+                morph.parse(token.text)
+
+
+def main():
+    import resource
+    import sys
+    import time
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else "trimmed"
+    start = time.perf_counter()
+    if mode == "full":
+        nlp = load_spacy(SPACY_MODEL)
+    else:
+        nlp = get_nlp()
+    elapsed = time.perf_counter() - start
+    # ru_maxrss в Linux — в килобайтах
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Режим: {mode}, компоненты: {', '.join(nlp.pipe_names)}")
+    print(f"Загрузка: {elapsed:.2f}s, пиковый RSS процесса: {rss_mb:.1f} MB")
+    print("Для сравнения запустите: python nlp_pipeline.py full")
+
+
+if __name__ == "__main__":
+    main()
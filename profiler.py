@@ -0,0 +1,112 @@
+"""
+Семплирующий профайлер работающего сервера.
+
+Пока профилирование идёт, поток админского запроса раз в INTERVAL_S снимает
+стеки потоков через sys._current_frames() и считает одинаковые стеки.
+Результат — collapsed stacks: строка «кадр;кадр;...;кадр число» на стек,
+формат flamegraph.pl, inferno и speedscope.
+
+  curl -X POST "http://localhost:8080/admin/profile?seconds=10" -H "X-Admin-Token: ..." > out.folded
+  flamegraph.pl out.folded > flame.svg
+
+Вне профилирования отдельного потока нет, а обработчик запроса проверяет один флаг.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+INTERVAL_S = 0.005
+MAX_DURATION_S = 120
+BATCHER_THREAD = "micro-batcher"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=INTERVAL_S):
+        self.interval = interval
+        self.active = False
+        self.fraction = 1.0
+        self._session = threading.Lock()
+        self._targets = set()
+        self._labels = {}
+
+    def start_request(self):
+        """Начало запроса; True, если поток запроса попал в выборку"""
+        if self.fraction < 1.0 and random.random() >= self.fraction:
+            return False
+        self._targets.add(threading.get_ident())
+        return True
+
+    def end_request(self):
+        self._targets.discard(threading.get_ident())
+
+    def profile(self, duration, fraction=1.0, all_threads=False):
+        """
+        Профилирует duration секунд в вызывающем потоке.
+        fraction — доля запросов, чьи потоки попадают в выборку; all_threads —
+        все потоки процесса, включая простаивающие.
+        Возвращает (Counter стеков, число снимков) или None, если профилирование уже идёт.
+        """
+        if not self._session.acquire(blocking=False):
+            return None
+        self_ident = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        try:
+            self._targets.clear()
+            self.fraction = fraction
+            self.active = True
+            deadline = time.monotonic() + min(duration, MAX_DURATION_S)
+            batchers, refresh_at = set(), 0.0
+            while time.monotonic() < deadline:
+                now = time.monotonic()
+                if now >= refresh_at:
+                    # Forward pass батча нельзя приписать одному запросу: поток
+                    # микробатчера семплируется только при полной выборке
+                    batchers = {t.ident for t in threading.enumerate() if t.name == BATCHER_THREAD}
+                    refresh_at = now + 1.0
+                wanted = None if all_threads else self._targets | (batchers if fraction >= 1.0 else set())
+                for ident, frame in sys._current_frames().items():
+                    if ident == self_ident or (wanted is not None and ident not in wanted):
+                        continue
+                    stacks[self._collapse(frame)] += 1
+                samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.active = False
+            self._targets.clear()
+            self._session.release()
+        return stacks, samples
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{short_path(code.co_filename)}:{code.co_name}"
+            labels.append(label)
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+
+def short_path(filename):
+    """Путь внутри site-packages или имя файла"""
+    _, sep, rest = filename.rpartition("site-packages" + os.sep)
+    return rest if sep else os.path.basename(filename)
+
+
+def render_collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def inclusive(stacks, top=30):
+    """Доля снимков, в которых кадр есть в стеке: [(кадр, доля)] по убыванию"""
+    total = sum(stacks.values())
+    counts = Counter()
+    for stack, count in stacks.items():
+        for label in set(stack.split(";")):
+            counts[label] += count
+    return [(label, round(count / total, 4)) for label, count in counts.most_common(top)] if total else []
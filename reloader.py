@@ -0,0 +1,163 @@
+"""
+Горячая замена модели без перезапуска и без потери запросов.
+
+Новая модель загружается в фоне, прогревается и проверяется на строках
+data.csv; только после этого ссылка на неё атомарно подменяет текущую.
+Запросы, уже получившие старую модель, дорабатывают на ней, после чего
+старые веса освобождаются.
+
+Запуск перезагрузки:
+  POST /admin/reload                  (server.py; заголовок X-Admin-Token, см. ADMIN_TOKEN)
+  kill -HUP <pid>                     (server.py; мастер serve.py перезапускает воркеров)
+  MODEL_WATCH_INTERVAL_S=10           (опрос mtime файлов каталога модели)
+"""
+import ctypes
+import gc
+import os
+import threading
+import time
+from datetime import datetime
+
+SANITY_ROWS = 32
+SANITY_MIN_ACCURACY = 0.8
+
+
+def sanity_check(backend, intents, data_path="data.csv", rows=SANITY_ROWS, min_accuracy=SANITY_MIN_ACCURACY):
+    """
+    Прогрев и проверка модели: одиночный запрос и батч из строк data.csv.
+    Возвращает (годна ли модель, точность на выборке).
+    """
+    import pandas as pd
+
+    df = pd.read_csv(data_path).dropna()
+    df = df.sample(n=min(rows, len(df)), random_state=0)
+    texts = [t.lower() for t in df["text"]]
+    backend.predict_proba(texts[:1])
+    probs = backend.predict_proba(texts)
+    if probs.shape != (len(texts), len(intents)):
+        return False, 0.0
+    predicted = [intents[i] for i in probs.argmax(axis=1)]
+    accuracy = sum(p == l for p, l in zip(predicted, df["label"])) / len(texts)
+    return accuracy >= min_accuracy, round(accuracy, 4)
+
+
+def model_mtime(model_dir):
+    """Последнее изменение файлов каталога модели; None, если каталога нет"""
+    try:
+        with os.scandir(model_dir) as entries:
+            return max((e.stat().st_mtime_ns for e in entries if e.is_file()), default=None)
+    except FileNotFoundError:
+        return None
+
+
+def release_memory():
+    """Собирает мусор и возвращает освобождённую кучу ОС (glibc)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ModelReloader:
+    """
+    load(model_dir) -> модель, check(модель) -> (годна, точность),
+    swap(модель) -> предыдущая модель.
+    """
+
+    def __init__(self, load, check, swap, model_dir):
+        self.load = load
+        self.check = check
+        self.swap = swap
+        self.model_dir = model_dir
+        self._busy = threading.Lock()
+        self.reloads = 0
+        self.failures = 0
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+        self.last_error = None
+        self.last_accuracy = None
+        self._seen_mtime = model_mtime(model_dir)
+        self._pending_mtime = None
+
+    def start(self, model_dir=None):
+        """Перезагрузка в фоновом потоке; False, если она уже идёт"""
+        if not self._busy.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, args=(model_dir or self.model_dir,), daemon=True).start()
+        return True
+
+    def reload(self, model_dir=None):
+        """Синхронная перезагрузка; True, если новая модель подменила старую"""
+        if not self._busy.acquire(blocking=False):
+            return False
+        return self._run(model_dir or self.model_dir)
+
+    @property
+    def in_progress(self):
+        return self._busy.locked()
+
+    def _run(self, model_dir):
+        candidate = old = None
+        try:
+            start = time.perf_counter()
+            candidate = self.load(model_dir)
+            ok, accuracy = self.check(candidate)
+            self.last_accuracy = accuracy
+            if not ok:
+                raise RuntimeError(f"Проверка на data.csv не пройдена: точность {accuracy}")
+            old = self.swap(candidate)
+            self.model_dir = model_dir
+            self._seen_mtime = model_mtime(model_dir)
+            self.reloads += 1
+            self.loaded_at = datetime.now().isoformat(timespec="seconds")
+            self.last_error = None
+            print(f"Модель {model_dir} загружена за {time.perf_counter() - start:.1f}s "
+                  f"(точность проверки {accuracy})", flush=True)
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Перезагрузка модели {model_dir} не удалась: {self.last_error}", flush=True)
+            return False
+        finally:
+            # Старая модель (или отбракованная новая) освобождается здесь;
+            # запросы, ещё держащие ссылку на старую, дорабатывают на ней
+            candidate = old = None
+            release_memory()
+            self._busy.release()
+
+    def changed(self):
+        """
+        Шаг опроса каталога модели: True, когда файлы изменились и не менялись
+        ещё один интервал опроса (копирование могло не закончиться)
+        """
+        current = model_mtime(self.model_dir)
+        if current is None or current == self._seen_mtime:
+            self._pending_mtime = None
+            return False
+        if current != self._pending_mtime:
+            self._pending_mtime = current
+            return False
+        self._seen_mtime, self._pending_mtime = current, None
+        return True
+
+    def watch(self, interval):
+        """Фоновая перезагрузка при изменении файлов модели"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if self.changed():
+                    self.start()
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def status(self):
+        return {
+            "model": self.model_dir,
+            "loaded_at": self.loaded_at,
+            "in_progress": self.in_progress,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_accuracy": self.last_accuracy,
+        }
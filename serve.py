@@ -0,0 +1,194 @@
+"""
+Продакшен-запуск: модель, токенизатор, spaCy и pymorphy2 загружаются один раз
+в мастер-процессе, затем мастер форкает N воркеров, которые делят веса
+через copy-on-write и принимают соединения с общего сокета.
+
+  python serve.py --workers 4 --threads 1 --port 8080
+
+SIGTERM/SIGINT: мастер пересылает сигнал воркерам, воркеры перестают принимать
+соединения и дорабатывают текущие запросы; по истечении --graceful-timeout
+оставшиеся воркеры завершаются принудительно.
+
+SIGHUP (или изменение файлов модели при --watch-interval): мастер загружает и
+проверяет новую модель, форкает новых воркеров и мягко останавливает старых.
+Сокет всё время открыт, поэтому соединения не теряются. POST /admin/reload
+в воркерах отклоняется (409): запрос попал бы в один воркер, а не в мастер.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+
+def parse_args():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="NLP-сервер с предфоркнутыми воркерами")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=cpus)
+    parser.add_argument("--threads", type=int, default=0,
+                        help="intra-op потоков инференса на воркер (по умолчанию cpu/workers)")
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--watch-interval", type=float, default=0.0,
+                        help="опрос каталога модели, секунд (0 — только по SIGHUP)")
+    args = parser.parse_args()
+    if args.threads <= 0:
+        args.threads = max(1, cpus // max(1, args.workers))
+    return args
+
+
+def run_worker(sock, host, port, app, threads):
+    from werkzeug.serving import make_server
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    # Ждём завершения потоков с запросами при остановке
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        # shutdown() блокируется до выхода из serve_forever, поэтому в отдельном потоке
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.serve_forever()
+    server.server_close()
+
+
+def spawn(sock, args, app):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, args.host, args.port, app, args.threads)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    args = parse_args()
+    # До импорта torch/onnxruntime, чтобы пулы потоков не создавались на все ядра
+    os.environ["INFERENCE_THREADS"] = str(args.threads)
+    os.environ.setdefault("OMP_NUM_THREADS", str(args.threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(args.threads))
+
+    import server
+    from nlp_pipeline import preload
+
+    server.PREFORK = True
+    preload()
+    # Объекты, созданные при загрузке, не трогаются сборщиком мусора в воркерах,
+    # иначе запись в их заголовки копировала бы общие страницы
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    workers = set()
+    retiring = set()
+    stopping = False
+    reload_requested = False
+
+    def signal_workers(signum):
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        signal_workers(signal.SIGTERM)
+
+    def request_reload(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+
+    def reload_workers():
+        """Новая модель в мастере, новые воркеры, мягкая остановка старых"""
+        gc.unfreeze()
+        if not server.reloader.reload():
+            gc.freeze()
+            return
+        gc.freeze()
+        if stopping:
+            return
+        old = set(workers)
+        workers.clear()
+        for _ in range(args.workers):
+            workers.add(spawn(sock, args, server.app))
+        retiring.update(old)
+        for pid in old:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        print(f"Мастер {os.getpid()}: воркеры перезапущены с моделью {server.reloader.model_dir}", flush=True)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, request_reload)
+
+    for _ in range(args.workers):
+        workers.add(spawn(sock, args, server.app))
+    print(f"Мастер {os.getpid()}: {args.workers} воркеров по {args.threads} потоков, "
+          f"http://{args.host}:{args.port}", flush=True)
+
+    deadline = None
+    next_watch = time.monotonic() + args.watch_interval
+    while workers or retiring:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + args.graceful_timeout
+            workers.update(retiring)
+            retiring.clear()
+        if not stopping and args.watch_interval > 0 and time.monotonic() >= next_watch:
+            next_watch = time.monotonic() + args.watch_interval
+            reload_requested = reload_requested or server.reloader.changed()
+        if reload_requested and not stopping:
+            reload_requested = False
+            reload_workers()
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                signal_workers(signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(0.1)
+            continue
+        if pid in retiring:
+            # Старый воркер доработал запросы после перезагрузки модели
+            retiring.discard(pid)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            # Упавший воркер перезапускается
+            print(f"Воркер {pid} завершился ({status}), перезапуск", file=sys.stderr, flush=True)
+            workers.add(spawn(sock, args, server.app))
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
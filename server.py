@@ -1,8 +1,23 @@
-from flask import Flask, request, jsonify
-import torch
-import torch.nn.functional as F
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from entity_extractor import extract_entities, intent_confidence
+import hmac
+import json
+import os
+import signal
+import time
+import uuid
+from datetime import datetime
+from functools import wraps
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import metrics
+from backends import load_backend
+from entity_extractor import GAZETTEER_STORE, catalog, extract_entities, extract_entities_batch, intent_confidence, normal_form
+from batcher import MicroBatcher
+from cache import LRUCache, SingleFlight, lru_stats, normalize_text, time_bucket
+from nlp_pipeline import preload
+from cascade import Cascade
+from embedding_index import IntentIndex
+from streaming import SessionStore
+from reloader import ModelReloader, sanity_check
+from profiler import SamplingProfiler, inclusive, render_collapsed
 
 app = Flask(__name__)
 
@@ -12,12 +27,64 @@ app = Flask(__name__)
 
 #cointegrated/rubert-tiny2 — самая лёгкая BERT-модель на русском
 
-MODEL_NAME = "./finetuned_model"
+MODEL_NAME = os.environ.get("MODEL_NAME", "./finetuned_model")
 CONFIDENCE_THRESHOLD = 0.6
+# torch | torch-int8 | onnx | onnx-int8, см. backends.py
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+# model — дообученная голова, index — ближайшие соседи в индексе эмбеддингов (embedding_index.py)
+INTENT_ENGINE = os.environ.get("INTENT_ENGINE", "model")
+INTENT_INDEX_PATH = os.environ.get("INTENT_INDEX_PATH", "./intent_index")
+INTENT_INDEX_TOP_K = 5
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-model.eval()
+# Микробатчинг: конкурентные запросы собираются в один forward pass
+BATCHING_ENABLED = True
+BATCH_MAX_SIZE = 16
+BATCH_MAX_WAIT_MS = 5  # добор батча, если в очереди уже больше одного запроса
+BATCH_TIMEOUT_S = 2.0  # бюджет ожидания результата одним запросом
+MAX_BATCH_TEXTS = 256  # лимит текстов в одном запросе к /nlp/batch
+
+# Кэш готовых ответов /nlp по нормализованному тексту и корзине времени
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIZE = 10000
+RESPONSE_CACHE_TTL_S = 3600
+
+# Извлекать только слоты, относящиеся к интенту (entity_extractor.INTENT_SLOTS);
+# остальные слоты в ответе остаются пустыми
+INTENT_CONDITIONED_ENTITIES = True
+
+# Одновременные запросы /nlp с одинаковым текстом считаются один раз
+COALESCE_ENABLED = True
+
+# Сессии частичных гипотез ASR (/nlp/stream): брошенные закрываются по TTL
+STREAM_SESSION_TTL_S = 30
+STREAM_MAX_SESSIONS = 1000
+
+# Правила для однозначных команд перед моделью (cascade.py)
+CASCADE_ENABLED = True
+
+# Разрешить отладочную разбивку по этапам в ответе: POST /nlp?timing=1
+TIMING_BREAKDOWN_ENABLED = True
+
+# Токен админских эндпоинтов (/admin/...), заголовок X-Admin-Token; без токена они выключены
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Горячая замена модели: проверка на строках data.csv перед подменой,
+# опрос каталога модели раз в MODEL_WATCH_INTERVAL_S секунд (0 — только по запросу и SIGHUP)
+RELOAD_SANITY_DATA = "data.csv"
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "0"))
+# Выставляет serve.py: модель воркеров меняет только мастер (SIGHUP), POST /admin/reload
+# в одном из воркеров разошёлся бы с остальными и с каталогом модели мастера
+PREFORK = False
+
+# Загружать spaCy и pymorphy2 при старте, а не на первом запросе
+PRELOAD_NLP = True
+
+if INTENT_ENGINE == "index":
+    backend = None
+    intent_index = IntentIndex.load(INTENT_INDEX_PATH, top_k=INTENT_INDEX_TOP_K)
+else:
+    backend = load_backend(INFERENCE_BACKEND, MODEL_NAME)
+    intent_index = None
 
 INTENTS = [
   "turn_on_light",        # 0
@@ -35,34 +102,373 @@ INTENTS = [
   "tv_android"            #12
 ]
 
+def predict_intent_batch(texts):
+    """Классификация списка текстов одним padded-батчем"""
+    if intent_index is not None:
+        return intent_index.predict_batch(texts)
+    probs = backend.predict_proba(texts)
+    results = []
+    for row in probs:
+        max_idx = row.argmax()
+        results.append((INTENTS[max_idx], float(row[max_idx])))
+    return results
+
+# Номер модели в ключах кэша ответов и объединения запросов: ответы старой
+# модели, досчитанные после подмены, не попадут к запросам новой.
+# Также учитывается номер перезагрузки словаря (GAZETTEER_STORE.reloads)
+model_generation = 0
+
+def swap_backend(new_backend):
+    """Атомарная подмена модели; запросы, уже взявшие старую, дорабатывают на ней"""
+    global backend, model_generation
+    old, backend = backend, new_backend
+    model_generation += 1
+    if response_cache is not None:
+        response_cache.clear()
+    return old
+
+def load_model(model_dir):
+    if intent_index is not None:
+        raise RuntimeError("INTENT_ENGINE=index: индекс подхватывает новые примеры сам")
+    return load_backend(INFERENCE_BACKEND, model_dir)
+
+reloader = ModelReloader(
+    load=load_model,
+    check=lambda candidate: sanity_check(candidate, INTENTS, RELOAD_SANITY_DATA),
+    swap=swap_backend,
+    model_dir=MODEL_NAME,
+)
+
+batcher = MicroBatcher(predict_intent_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS) if BATCHING_ENABLED else None
+response_cache = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S) if RESPONSE_CACHE_ENABLED else None
+in_flight = SingleFlight() if COALESCE_ENABLED else None
+
 def predict_intent(text: str):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        probs = F.softmax(outputs.logits, dim=1).cpu().numpy()[0]
-    max_idx = probs.argmax()
-    return INTENTS[max_idx], float(probs[max_idx])
+    with metrics.stage("intent"):
+        if batcher is not None:
+            return batcher(text, timeout=BATCH_TIMEOUT_S)
+        return predict_intent_batch([text])[0]
+
+cascade = Cascade(predict_intent, predict_intent_batch, enabled=CASCADE_ENABLED)
+stream_sessions = SessionStore(cascade.predict_stream, STREAM_MAX_SESSIONS, STREAM_SESSION_TTL_S)
+
+@metrics.register_collector
+def cascade_metrics():
+    stats = cascade.stats()
+    return [
+        ("nlp_cascade_rules_total", "counter", "Запросы, классифицированные правилами", stats["rules"]),
+        ("nlp_cascade_model_total", "counter", "Запросы, дошедшие до модели", stats["model"]),
+        ("nlp_cascade_stream_rules_total", "counter", "Частичные гипотезы, классифицированные правилами",
+         stats["stream_rules"]),
+        ("nlp_cascade_stream_model_total", "counter", "Частичные гипотезы, дошедшие до модели", stats["stream_model"]),
+    ]
+
+@metrics.register_collector
+def cache_metrics():
+    if response_cache is None:
+        return []
+    stats = response_cache.stats()
+    return [
+        ("nlp_response_cache_hits_total", "counter", "Попадания в кэш ответов", stats["hits"]),
+        ("nlp_response_cache_misses_total", "counter", "Промахи кэша ответов", stats["misses"]),
+        ("nlp_response_cache_evictions_total", "counter", "Вытеснения из кэша ответов", stats["evictions"]),
+        ("nlp_response_cache_size", "gauge", "Записей в кэше ответов", stats["size"]),
+    ]
+
+def memo_stats():
+    """Кэши токенизатора (по бэкенду), нормальных форм pymorphy2 и поиска по словарю"""
+    if intent_index is not None:
+        encode = intent_index.encoder.tokens
+    else:
+        encode = getattr(backend, "encode", None)
+    return {
+        "token_ids": encode.stats() if encode is not None else None,
+        "normal_forms": lru_stats(normal_form),
+        "gazetteer": catalog().lookup_stats(),
+    }
+
+@metrics.register_collector
+def memo_metrics():
+    result = []
+    for name, stats in memo_stats().items():
+        if stats is None:
+            continue
+        result += [
+            (f"nlp_memo_{name}_hits_total", "counter", f"Попадания в кэш {name}", stats["hits"]),
+            (f"nlp_memo_{name}_misses_total", "counter", f"Промахи кэша {name}", stats["misses"]),
+            (f"nlp_memo_{name}_size", "gauge", f"Записей в кэше {name}", stats["size"]),
+        ]
+    return result
+
+@metrics.register_collector
+def coalesce_metrics():
+    if in_flight is None:
+        return []
+    stats = in_flight.stats()
+    return [
+        ("nlp_coalesce_leaders_total", "counter", "Запросы, выполнившие обработку за себя и дубликаты", stats["leaders"]),
+        ("nlp_coalesce_coalesced_total", "counter", "Запросы, получившие результат одновременного дубликата", stats["coalesced"]),
+        ("nlp_coalesce_in_flight", "gauge", "Уникальные тексты в обработке", stats["in_flight"]),
+    ]
+
+@metrics.register_collector
+def stream_metrics():
+    stats = stream_sessions.stats()
+    return [
+        ("nlp_stream_sessions", "gauge", "Открытые сессии частичных гипотез", stats["sessions"]),
+        ("nlp_stream_updates_total", "counter", "Обработанные частичные гипотезы", stats["updates"]),
+        ("nlp_stream_reused_tokens_total", "counter", "Токены, взятые из прошлой гипотезы", stats["reused_tokens"]),
+        ("nlp_stream_parsed_tokens_total", "counter", "Токены, разобранные spaCy заново", stats["parsed_tokens"]),
+    ]
+
+profiler = SamplingProfiler()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if profiler.active:
+        g.profiled = profiler.start_request()
+    if TIMING_BREAKDOWN_ENABLED and request.args.get("timing"):
+        g.trace = metrics.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    metrics.REQUESTS.inc(endpoint=request.endpoint or "unknown", status=response.status_code)
+    metrics.STAGE_LATENCY.observe(time.perf_counter() - g.request_start, stage="request")
+    metrics.stop_trace()
+    return response
+
+@app.teardown_request
+def end_request_profile(exc):
+    # teardown, а не after_request: потоковые ответы к этому моменту уже отданы
+    if g.get("profiled"):
+        profiler.end_request()
+
+def respond(payload):
+    """JSON-ответ; при ?timing=1 добавляет разбивку по этапам в миллисекундах"""
+    trace = g.get("trace")
+    if trace is not None:
+        trace["total"] = time.perf_counter() - g.request_start
+        payload = dict(payload, timing=metrics.format_trace(trace))
+    with metrics.stage("json_encode"):
+        return jsonify(payload)
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin endpoints are disabled"}), 404
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/admin/reload", methods=["GET", "POST"])
+@admin_required
+def reload_handler():
+    """POST {"model": каталог} — перезагрузка в фоне, ?wait=1 — дождаться результата; GET — состояние"""
+    if request.method == "GET":
+        return jsonify(reloader.status())
+    if PREFORK:
+        return jsonify({"error": "Under serve.py reload the model with SIGHUP to the master process",
+                        "master_pid": os.getppid()}), 409
+    model_dir = (request.get_json(silent=True) or {}).get("model")
+    if request.args.get("wait"):
+        ok = reloader.reload(model_dir)
+        return jsonify({"ok": ok, **reloader.status()}), 200 if ok else 409
+    if not reloader.start(model_dir):
+        return jsonify({"error": "Reload already in progress", **reloader.status()}), 409
+    return jsonify(reloader.status()), 202
+
+@app.route("/admin/profile", methods=["POST"])
+@admin_required
+def profile_handler():
+    """
+    Семплирующее профилирование на ?seconds=N (по умолчанию 10).
+    ?fraction=0.1 — только каждый десятый запрос, ?all=1 — все потоки процесса.
+    Ответ — collapsed stacks для flamegraph.pl; ?format=json — ещё и доли кадров.
+    """
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        fraction = float(request.args.get("fraction", 1.0))
+    except ValueError:
+        return jsonify({"error": "Invalid 'seconds' or 'fraction'"}), 400
+    if seconds <= 0 or not 0 < fraction <= 1:
+        return jsonify({"error": "Expected seconds > 0 and 0 < fraction <= 1"}), 400
+
+    result = profiler.profile(seconds, fraction, all_threads=bool(request.args.get("all")))
+    if result is None:
+        return jsonify({"error": "Profiling already in progress"}), 409
+    stacks, samples = result
+    if request.args.get("format") == "json":
+        return jsonify({"samples": samples, "interval_s": profiler.interval,
+                        "inclusive": inclusive(stacks), "collapsed": render_collapsed(stacks)})
+    return Response(render_collapsed(stacks), mimetype="text/plain",
+                    headers={"X-Profile-Samples": str(samples)})
+
+@metrics.register_collector
+def reload_metrics():
+    stats = reloader.status()
+    return [
+        ("nlp_model_reloads_total", "counter", "Успешные горячие замены модели", stats["reloads"]),
+        ("nlp_model_reload_failures_total", "counter", "Отклонённые или упавшие замены модели", stats["failures"]),
+    ]
+
+@app.route("/metrics", methods=["GET"])
+def metrics_handler():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/nlp", methods=["POST"])
 def nlp_handler():
     data = request.get_json(force=True)
-    text = data.get("text", "").lower()
+    text = normalize_text(data.get("text", ""))
     if not text:
         return jsonify({"error": "Empty text"}), 400
 
-    intent, confidence = predict_intent(text)
-    entities = extract_entities(text)  # функция для извлечения сущностей
+    return respond(cached_process(text, datetime.now()))
+
+def generation():
+    """Версии модели и словаря, от которых зависит ответ"""
+    catalog()  # проверяет, не сменился ли артефакт словаря
+    return model_generation, GAZETTEER_STORE.reloads
+
+def cached_process(text, now):
+    """process_text через кэш ответов; одновременные одинаковые запросы считаются один раз"""
+    current = generation()
+    key = (text, time_bucket(text, now), current)
+    if response_cache is not None:
+        response = response_cache.get(key)
+        if response is not None:
+            return response
+
+    def compute():
+        response = process_text(text, now)
+        if response_cache is not None and current == generation():
+            response_cache.put(key, response)
+        return response
+
+    if in_flight is None:
+        return compute()
+    return in_flight.do(key, compute)
+
+@app.route("/nlp/cache", methods=["GET"])
+def cache_stats_handler():
+    if response_cache is None:
+        return jsonify({"enabled": False, "memo": memo_stats()})
+    return jsonify({"enabled": True, **response_cache.stats(), "memo": memo_stats()})
+
+def process_text(text, now=None):
+    """Полная обработка одного текста: интент и сущности"""
+    intent, confidence = cascade.predict(text)
+    entities = extract_entities(text, now, slot_intent(intent, confidence))  # функция для извлечения сущностей
+    return build_response(text, intent, confidence, entities)
+
+def slot_intent(intent, confidence):
+    """Интент, по которому выбираются экстракторы слотов; None — извлекать все слоты"""
+    if not INTENT_CONDITIONED_ENTITIES or confidence < CONFIDENCE_THRESHOLD:
+        return None
+    return intent
 
+@app.route("/nlp/batch", methods=["POST"])
+def nlp_batch_handler():
+    data = request.get_json(force=True)
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not texts:
+        return jsonify({"error": "Expected non-empty list in 'texts'"}), 400
+    if len(texts) > MAX_BATCH_TEXTS:
+        return jsonify({"error": f"Too many texts, max {MAX_BATCH_TEXTS}"}), 400
+
+    return respond({"results": process_batch(texts, datetime.now())})
+
+def process_batch(texts, now=None):
+    """Обработка списка текстов: интенты одним батчем, сущности через nlp.pipe"""
+    texts = [normalize_text(str(t or "")) for t in texts]
+    valid = [t for t in texts if t]
+    with metrics.stage("intent"):
+        predicted = cascade.predict_batch(valid) if valid else []
+    entities = iter(extract_entities_batch(
+        valid, reference_date=now,
+        intents=[slot_intent(intent, confidence) for intent, confidence in predicted],
+    ))
+    intents = iter(predicted)
+
+    results = []
+    for text in texts:
+        if not text:
+            results.append({"text": text, "error": "Empty text"})
+            continue
+        intent, confidence = next(intents)
+        results.append(build_response(text, intent, confidence, next(entities)))
+    return results
+
+@app.route("/nlp/stream", methods=["POST"])
+def nlp_stream_handler():
+    """
+    Частичные гипотезы ASR.
+    JSON {"session", "text", "final"} — одна гипотеза на запрос.
+    application/x-ndjson — все гипотезы фразы одним chunked-запросом (?session= необязателен),
+    ответ на каждую строку отдаётся сразу, поток завершается гипотезой с "final": true.
+    """
+    if request.mimetype == "application/x-ndjson":
+        session_id = request.args.get("session") or uuid.uuid4().hex
+        return Response(stream_with_context(stream_lines(session_id)), mimetype="application/x-ndjson")
+
+    data = request.get_json(force=True)
+    session_id = data.get("session")
+    if not session_id:
+        return jsonify({"error": "Missing 'session'"}), 400
+    text = normalize_text(data.get("text") or "")
+    if not text:
+        return jsonify({"error": "Empty text"}), 400
+    return respond(stream_step(str(session_id), text, bool(data.get("final")), datetime.now()))
+
+def stream_lines(session_id):
+    try:
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                text = normalize_text(str(item.get("text") or ""))
+            except (ValueError, AttributeError):
+                yield json.dumps({"session": session_id, "error": "Invalid JSON line"}) + "\n"
+                continue
+            final = bool(item.get("final"))
+            if not text:
+                yield json.dumps({"session": session_id, "error": "Empty text"}) + "\n"
+            else:
+                yield json.dumps(stream_step(session_id, text, final, datetime.now()), ensure_ascii=False) + "\n"
+            if final:
+                break
+    finally:
+        stream_sessions.commit(session_id)
+
+def stream_step(session_id, text, final, now):
+    """Предварительный ответ на частичную гипотезу или окончательный — на final"""
+    if final:
+        stream_sessions.commit(session_id)
+        response = cached_process(text, now)
+    else:
+        intent, confidence, entities = stream_sessions.update(session_id, text, now)
+        response = build_response(text, intent, confidence, entities)
+    return dict(response, session=session_id, final=final)
+
+def build_response(text, intent, confidence, entities):
+    """Формирует ответ /nlp для одного текста"""
     if confidence < CONFIDENCE_THRESHOLD:
         intent = "unknown_command"
-
-    return jsonify({
+    return {
         "text": text,
         "intent": intent,
         "intent_score": round(confidence, 3),
         "entities": entities
-    })
+    }
 
 if __name__ == "__main__":
+    if PRELOAD_NLP:
+        preload()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reloader.start())
+    if MODEL_WATCH_INTERVAL_S > 0:
+        reloader.watch(MODEL_WATCH_INTERVAL_S)
     app.run(host="0.0.0.0", port=8080)
 
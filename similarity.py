@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+
+from nlp_pipeline import get_nlp
+
+
+def normalize_rows(matrix):
+    """Нормирует строки; нулевые векторы остаются нулевыми (сходство 0, как у doc.similarity)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def doc_vectors(texts, batch_size=64):
+    """Матрица векторов документов через nlp.pipe"""
+    docs = list(get_nlp().pipe(texts, batch_size=batch_size))
+    if not docs:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack([doc.vector for doc in docs]).astype(np.float32)
+
+
+class KeywordScorer:
+    """
+    Косинусное сходство текста с ключевыми словами интентов.
+    Векторы ключевых слов считаются один раз и хранятся одной нормированной
+    матрицей; оценка текста — одно матрично-векторное произведение.
+    """
+
+    def __init__(self, intent_keywords):
+        self.intents = list(intent_keywords)
+        keywords = []
+        self._offsets = []
+        for intent in self.intents:
+            self._offsets.append(len(keywords))
+            keywords.extend(intent_keywords[intent])
+        self.size = len(keywords)
+        self.matrix = normalize_rows(doc_vectors(keywords)) if keywords else None
+
+    def score_batch(self, texts):
+        """Матрица (тексты x интенты) с максимальным сходством по ключевым словам интента"""
+        scores = np.zeros((len(texts), len(self.intents)), dtype=np.float32)
+        if not texts or self.matrix is None:
+            return scores
+        sims = normalize_rows(doc_vectors([t.lower() for t in texts])) @ self.matrix.T
+        # Максимум по сегменту ключевых слов каждого интента; пустой сегмент даёт 0
+        for col, start in enumerate(self._offsets):
+            end = self._offsets[col + 1] if col + 1 < len(self._offsets) else self.size
+            if end > start:
+                scores[:, col] = sims[:, start:end].max(axis=1)
+        return np.clip(scores, 0.0, 1.0)
+
+    def score(self, text):
+        """Словарь {интент: сходство} для одного текста"""
+        row = self.score_batch([text])[0]
+        return {intent: float(s) for intent, s in zip(self.intents, row)}
+
+
+_scorers = {}
+_lock = threading.Lock()
+
+
+def get_scorer(intent_keywords):
+    """
+    Кэшированный KeywordScorer. intent_keywords — словарь {интент: [ключевые слова]}
+    или просто список ключевых слов (тогда интент один, с ключом None).
+    """
+    if not isinstance(intent_keywords, dict):
+        intent_keywords = {None: list(intent_keywords)}
+    key = tuple((intent, tuple(kws)) for intent, kws in intent_keywords.items())
+    scorer = _scorers.get(key)
+    if scorer is None:
+        with _lock:
+            scorer = _scorers.get(key)
+            if scorer is None:
+                scorer = _scorers[key] = KeywordScorer(intent_keywords)
+    return scorer
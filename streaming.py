@@ -0,0 +1,106 @@
+"""
+Инкрементальная обработка частичных гипотез ASR.
+
+Распознаватель присылает растущие гипотезы одной фразы:
+«включи» -> «включи свет» -> «включи свет на кух» -> «включи свет на кухне».
+Сессия помнит признаки токенов прошлой гипотезы и прогоняет через spaCy
+только слова после общего с ней префикса; интент пересчитывается, только
+если текст изменился. Окончательная гипотеза обрабатывается полным пайплайном,
+как в /nlp, а сессия закрывается.
+"""
+import re
+import threading
+
+from cache import LRUCache
+from entity_extractor import entities_from_features, token_features
+from metrics import stage
+from nlp_pipeline import get_nlp
+
+WORD_RE = re.compile(r"\S+")
+
+
+def stable_prefix(old, new):
+    """Позиция в new, начиная с которой слова отличаются от old"""
+    old_words = WORD_RE.finditer(old)
+    for word in WORD_RE.finditer(new):
+        prev = next(old_words, None)
+        if prev is None or prev.start() != word.start() or prev.group() != word.group():
+            return word.start()
+    return len(new)
+
+
+class StreamSession:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.text = ""
+        self.tokens = []
+        self.cities = []
+        self.intent = None
+
+    def update(self, text, reference_date, intent_fn):
+        """(интент, уверенность, сущности, переиспользовано токенов, разобрано токенов)"""
+        with self.lock:
+            if text != self.text:
+                start = stable_prefix(self.text, text)
+                tokens = [t for t in self.tokens if t[0] + len(t[3]) <= start]
+                cities = [c for c in self.cities if c[0] + len(c[1]) <= start]
+                reused = len(tokens)
+                tail = text[start:]
+                if tail.strip():
+                    with stage("spacy"):
+                        new_tokens, new_cities = token_features(get_nlp()(tail))
+                    tokens += [(idx + start, *rest) for idx, *rest in new_tokens]
+                    cities += [(idx + start, city) for idx, city in new_cities]
+                self.text, self.tokens, self.cities = text, tokens, cities
+                self.intent = intent_fn(text)
+            else:
+                reused = len(self.tokens)
+            with stage("entities"):
+                entities = entities_from_features(self.tokens, self.cities, text, reference_date)
+            return (*self.intent, entities, reused, len(self.tokens) - reused)
+
+
+class SessionStore:
+    """Сессии по идентификатору; брошенные сессии вытесняются по TTL и размеру"""
+
+    def __init__(self, intent_fn, maxsize=1000, ttl=30.0):
+        self.intent_fn = intent_fn
+        self._sessions = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.commits = 0
+        self.reused_tokens = 0
+        self.parsed_tokens = 0
+
+    def update(self, session_id, text, reference_date=None):
+        """Предварительный результат для очередной гипотезы: (интент, уверенность, сущности)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = StreamSession()
+            # put продлевает TTL активной сессии
+            self._sessions.put(session_id, session)
+        intent, confidence, entities, reused, parsed = session.update(text, reference_date, self.intent_fn)
+        with self._lock:
+            self.updates += 1
+            self.reused_tokens += reused
+            self.parsed_tokens += parsed
+        return intent, confidence, entities
+
+    def commit(self, session_id):
+        """Закрывает сессию после окончательной гипотезы"""
+        if self._sessions.pop(session_id) is not None:
+            with self._lock:
+                self.commits += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.reused_tokens + self.parsed_tokens
+            return {
+                "sessions": self._sessions.stats()["size"],
+                "updates": self.updates,
+                "commits": self.commits,
+                "reused_tokens": self.reused_tokens,
+                "parsed_tokens": self.parsed_tokens,
+                "reuse_rate": round(self.reused_tokens / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,186 @@
+"""
+Разбор временных выражений: период суток, выходные, относительные дни,
+дни недели, даты (число + месяц) и время будильника.
+
+Все шаблоны компилируются один раз при создании TemporalParser,
+результат разбора переиспользуется слотами погоды и будильника.
+
+Микробенчмарк на data.csv:
+  python temporal.py --repeat 50
+"""
+import argparse
+import re
+import time as _time
+from datetime import datetime, time, timedelta
+
+MONTHS = {
+    "января": 1, "февраля": 2, "марта": 3, "апреля": 4,
+    "мая": 5, "июня": 6, "июля": 7, "августа": 8,
+    "сентября": 9, "октября": 10, "ноября": 11, "декабря": 12
+}
+
+WEEKEND_RE = re.compile(r"\b(выходн|викенд|конец недел)\w*\b")
+DATE_RE = re.compile(
+    r"(\d{1,2})(?:\s*[-.]?\s*го)?\s*(" + "|".join(MONTHS) + r")?"
+)
+TIME_RE = re.compile(r"\b(\d{1,2})(?:[:.\s](\d{1,2}))?\s*(утра|вечера|ночи|дня)?\b")
+
+
+def _alternation(words):
+    # Длинные варианты первыми, чтобы префикс не перехватывал совпадение
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+class TemporalResult:
+    """Результат разбора временного выражения"""
+    __slots__ = ("date", "time", "period", "date_str")
+
+    def __init__(self):
+        self.date = None
+        self.time = None
+        self.period = None
+        self.date_str = None
+
+    def set_date(self, date):
+        self.date = date
+        self.date_str = date.strftime("%Y-%m-%d")
+
+    def as_dict(self):
+        return {
+            "date": self.date,
+            "time": self.time,
+            "period": self.period,
+            "date_str": self.date_str,
+        }
+
+
+class TemporalParser:
+    """
+    Скомпилированный парсер временных выражений.
+    time_periods ищутся как подстроки (побеждает последний в списке),
+    relative_days — целыми словами, days_of_week — как подстроки
+    (в обоих случаях побеждает первый в словаре).
+    """
+
+    def __init__(self, time_periods, relative_days, days_of_week):
+        self.time_periods = {p: i for i, p in enumerate(time_periods)}
+        self.relative_days = dict(relative_days)
+        self.relative_order = {d: i for i, d in enumerate(relative_days)}
+        self.days_of_week = dict(days_of_week)
+        self.days_order = {d: i for i, d in enumerate(days_of_week)}
+
+        # Опережающая проверка находит и перекрывающиеся вхождения
+        self.period_re = re.compile(f"(?=({_alternation(time_periods)}))")
+        self.relative_re = re.compile(rf"\b({_alternation(relative_days)})\b")
+        self.days_re = re.compile(f"(?=({_alternation(days_of_week)}))")
+
+    def parse(self, text, reference_date=None):
+        """Разбирает текст относительно reference_date (по умолчанию — сейчас)"""
+        if reference_date is None:
+            reference_date = datetime.now()
+
+        text = text.lower()
+        result = TemporalResult()
+
+        # Поиск периода (утро, день, вечер, ночь)
+        periods = self.period_re.findall(text)
+        if periods:
+            result.period = max(periods, key=self.time_periods.__getitem__)
+
+        # Поиск выходных
+        if WEEKEND_RE.search(text):
+            # Находим ближайшие выходные (субботу)
+            days_to_saturday = (5 - reference_date.weekday()) % 7 or 7
+            result.set_date(reference_date + timedelta(days=days_to_saturday))
+            result.period = "weekend"
+            return result  # Выходные имеют приоритет
+
+        # Поиск относительных дней (сегодня, завтра)
+        days = self.relative_re.findall(text)
+        if days:
+            day = min(days, key=self.relative_order.__getitem__)
+            result.set_date(reference_date + timedelta(days=self.relative_days[day]))
+
+        # Поиск дней недели
+        days = self.days_re.findall(text)
+        if days:
+            day = min(days, key=self.days_order.__getitem__)
+            days_ahead = self.days_of_week[day] - reference_date.weekday()
+            if days_ahead <= 0:
+                days_ahead += 7
+            result.set_date(reference_date + timedelta(days=days_ahead))
+
+        # Поиск дат (число + месяц)
+        date_match = DATE_RE.search(text)
+        if date_match:
+            day = int(date_match.group(1))
+            month_name = date_match.group(2)
+            month = MONTHS[month_name] if month_name else reference_date.month
+            year = reference_date.year
+            try:
+                target_date = datetime(year, month, day).date()
+                if target_date < reference_date.date():
+                    target_date = datetime(year + 1, month, day).date()
+                result.set_date(target_date)
+            except ValueError:
+                pass
+
+        # Поиск времени будильника
+        time_match = TIME_RE.search(text)
+        if time_match:
+            hour = int(time_match.group(1))
+            minute = int(time_match.group(2)) if time_match.group(2) else 0
+            period = time_match.group(3)
+
+            # Коррекция времени по периоду дня
+            if period in ("вечера", "ночи", "дня") and 1 <= hour <= 11:
+                hour += 12
+            elif period == "утра" and hour == 12:
+                hour = 0
+
+            # Ограничение значений времени
+            hour = max(0, min(23, hour))
+            minute = max(0, min(59, minute))
+            result.time = f"{hour:02d}:{minute:02d}"
+
+            # Если время уже прошло сегодня - ставим на завтра
+            if time(hour, minute) <= reference_date.time():
+                result.set_date(reference_date + timedelta(days=1))
+            else:
+                result.set_date(reference_date)
+
+        # Дефолтные значения для периода
+        if not result.date and result.period:
+            result.set_date(reference_date)
+
+        return result
+
+
+def main():
+    import pandas as pd
+    from entity_extractor import catalog, find_keywords
+
+    parser = argparse.ArgumentParser(description="Микробенчмарк разбора времени на data.csv")
+    parser.add_argument("--data", default="data.csv")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    texts = [t.lower() for t in pd.read_csv(args.data)["text"].dropna()]
+    reference_date = datetime.now()
+    # Сколько текстов раньше разбиралось дважды (и погода, и будильник)
+    both = sum("weather_cmd" in hits and "alarm_cmd" in hits for hits in map(find_keywords, texts))
+    temporal = catalog().temporal
+
+    start = _time.perf_counter()
+    for _ in range(args.repeat):
+        for text in texts:
+            temporal.parse(text, reference_date)
+    elapsed = _time.perf_counter() - start
+
+    calls = args.repeat * len(texts)
+    print(f"Текстов: {len(texts)}, повторов: {args.repeat}, с погодой и будильником: {both}")
+    print(f"TemporalParser.parse: {elapsed / calls * 1e6:.2f} мкс/текст")
+
+
+if __name__ == "__main__":
+    main()
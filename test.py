@@ -1,3 +1,4 @@
+import threading
 import unittest
 import requests
 from datetime import datetime, timedelta
@@ -267,5 +268,129 @@ class TestNLPAPI(unittest.TestCase):
                 self.assertEqual(data["intent"], case["expected"]["intent"])
                 self.assertFalse(data["entities"])  # Не должно быть извлеченных сущностей
 
+    def test_batch_queries(self):
+        texts = ["включи свет на кухне", "", "выключи телевизор в спальне"]
+        response = requests.post(
+            self.BASE_URL + "/batch",
+            headers=self.HEADERS,
+            json={"texts": texts}
+        )
+        results = response.json()["results"]
+
+        self.assertEqual([r["text"] for r in results], texts)
+        self.assertEqual(results[1]["error"], "Empty text")
+
+        for text, item in zip(texts, results):
+            if not text:
+                continue
+            with self.subTest(case=text):
+                single = requests.post(
+                    self.BASE_URL,
+                    headers=self.HEADERS,
+                    json={"text": text}
+                ).json()
+                self.assertEqual(item["intent"], single["intent"])
+                self.assertDictEqual(item["entities"], single["entities"])
+
+    def test_response_cache(self):
+        stats_url = self.BASE_URL + "/cache"
+        if not requests.get(stats_url).json()["enabled"]:
+            self.skipTest("Кэш ответов выключен")
+
+        text = "включи свет на кухне"
+        first = requests.post(self.BASE_URL, headers=self.HEADERS, json={"text": text}).json()
+        hits_before = requests.get(stats_url).json()["hits"]
+        second = requests.post(self.BASE_URL, headers=self.HEADERS, json={"text": "  Включи свет   на кухне"}).json()
+        hits_after = requests.get(stats_url).json()["hits"]
+
+        self.assertEqual(first, second)
+        self.assertEqual(hits_after, hits_before + 1)
+
+    def test_stream_queries(self):
+        session = "test-stream"
+        partials = ["включи", "включи свет", "включи свет на кух", "включи свет на кухне"]
+        for text in partials:
+            response = requests.post(
+                self.BASE_URL + "/stream", headers=self.HEADERS,
+                json={"session": session, "text": text}
+            )
+            self.assertEqual(response.status_code, 200)
+            result = response.json()
+            self.assertFalse(result["final"])
+            self.assertEqual(result["text"], text)
+
+        final = requests.post(
+            self.BASE_URL + "/stream", headers=self.HEADERS,
+            json={"session": session, "text": partials[-1], "final": True}
+        ).json()
+        single = requests.post(self.BASE_URL, headers=self.HEADERS, json={"text": partials[-1]}).json()
+        self.assertTrue(final["final"])
+        self.assertEqual(final["intent"], single["intent"])
+        self.assertEqual(final["entities"], single["entities"])
+        self.assertEqual(final["entities"]["room"], "кухня")
+
+class FixedBackend:
+    """Бэкенд с одним и тем же ответом; gate задерживает инференс до set()"""
+    name = "fixed"
+
+    def __init__(self, intents, intent, gate=None):
+        self.row = [0.0] * len(intents)
+        self.row[intents.index(intent)] = 0.95
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def predict_proba(self, texts):
+        import numpy as np
+
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return np.array([self.row] * len(texts))
+
+
+class TestModelSwap(unittest.TestCase):
+    """Подмена модели посреди запроса; в процессе, без запущенного сервера"""
+    TEXT = "сделай потеплее"
+
+    @classmethod
+    def setUpClass(cls):
+        import server
+        cls.server = server
+
+    def setUp(self):
+        self.original = self.server.backend
+        # Задержанный инференс занял бы поток микро-батчера и для второго запроса
+        self.batcher, self.server.batcher = self.server.batcher, None
+
+    def tearDown(self):
+        self.server.batcher = self.batcher
+        self.server.swap_backend(self.original)
+
+    def test_swap_during_request(self):
+        server = self.server
+        now = datetime.now()
+        gate = threading.Event()
+        old = FixedBackend(server.INTENTS, "set_temperature", gate)
+        server.swap_backend(old)
+
+        results = {}
+        first = threading.Thread(target=lambda: results.update(old=server.cached_process(self.TEXT, now)))
+        first.start()
+        self.assertTrue(old.entered.wait(5))
+
+        # Запрос после подмены не присоединяется к вычислению на старой модели
+        server.swap_backend(FixedBackend(server.INTENTS, "tv_android"))
+        second = threading.Thread(target=lambda: results.update(new=server.cached_process(self.TEXT, now)))
+        second.start()
+        second.join(5)
+        self.assertFalse(second.is_alive())
+        self.assertEqual(results["new"]["intent"], "tv_android")
+
+        # Досчитанный на старой модели ответ не попадает в кэш
+        gate.set()
+        first.join(5)
+        self.assertEqual(results["old"]["intent"], "set_temperature")
+        self.assertEqual(server.cached_process(self.TEXT, now)["intent"], "tv_android")
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,15 @@
+import hashlib
+import os
+import shutil
 import pandas as pd
-from datasets import Dataset, ClassLabel
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments
+from datasets import Dataset, ClassLabel, load_from_disk
+from transformers import (
+    AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments,
+    DataCollatorWithPadding, EarlyStoppingCallback,
+)
 import numpy as np
 import torch
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
 #"DeepPavlov/rubert-base-cased"
 
@@ -12,53 +19,41 @@ import torch
 
 MODEL_NAME = "cointegrated/rubert-tiny"
 NUM_LABELS = 13  # число интентов, смотри в data.csv
+DATA_PATH = "data.csv"
+OUTPUT_DIR = "./finetuned_model"
+MAX_LENGTH = 64
+CACHE_DIR = "./.cache/tokenized"
+NUM_WORKERS = min(4, os.cpu_count() or 1)  # процессы DataLoader
+MAX_EPOCHS = 100  # верхняя граница, обучение останавливается раньше по eval
+EARLY_STOPPING_PATIENCE = 5  # эпох без улучшения accuracy
+
+
+def cache_key(tokenizer, label2id):
+    """Хэш данных, токенизатора и параметров токенизации"""
+    h = hashlib.sha256()
+    with open(DATA_PATH, "rb") as f:
+        h.update(f.read())
+    if tokenizer.is_fast:
+        h.update(tokenizer.backend_tokenizer.to_str().encode())
+    else:
+        h.update(repr(sorted(tokenizer.get_vocab().items())).encode())
+    h.update(f"{MODEL_NAME}|{MAX_LENGTH}|{label2id}".encode())
+    return h.hexdigest()[:16]
+
+
+def encode(dataset, tokenizer):
+    """Токенизация колонки text"""
+    # Без паддинга: батчи добиваются до своей максимальной длины коллатором
+    return dataset.map(lambda examples: tokenizer(examples["text"], truncation=True, max_length=MAX_LENGTH),
+                       batched=True)
+
+
+def as_model_inputs(dataset):
+    """Указываем столбцы, которые будут входом модели"""
+    dataset = dataset.rename_column("label_id", "labels")
+    dataset.set_format(type='torch', columns=['input_ids', 'attention_mask', 'labels'])
+    return dataset
 
-# Загрузка данных
-df = pd.read_csv("data.csv")
-
-# Преобразование меток в индексы
-labels = list(df["label"].unique())
-label2id = {l: i for i, l in enumerate(labels)}
-id2label = {i: l for l, i in label2id.items()}
-
-df["label_id"] = df["label"].map(label2id)
-
-# Создаем датасет
-dataset = Dataset.from_pandas(df)
-
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-
-def preprocess_function(examples):
-    return tokenizer(examples["text"], truncation=True, padding="max_length", max_length=64)
-
-dataset = dataset.map(preprocess_function, batched=True)
-
-# Указываем столбцы, которые будут входом модели
-dataset = dataset.rename_column("label_id", "labels")
-dataset.set_format(type='torch', columns=['input_ids', 'attention_mask', 'labels'])
-
-# Разбиваем на train и eval
-split = dataset.train_test_split(test_size=0.2, seed=42)
-train_dataset = split["train"]
-eval_dataset = split["test"]
-
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=len(labels))
-
-training_args = TrainingArguments(
-    output_dir="./finetuned_model",
-    evaluation_strategy="epoch",
-    save_strategy="epoch",
-    learning_rate=2e-5,
-    per_device_train_batch_size=16,
-    per_device_eval_batch_size=16,
-    num_train_epochs=100,
-    weight_decay=0.01,
-    save_total_limit=2,
-    load_best_model_at_end=True,
-    metric_for_best_model="accuracy"
-)
-
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
 def compute_metrics(eval_pred):
     logits, labels = eval_pred
@@ -72,18 +67,85 @@ def compute_metrics(eval_pred):
         "recall": recall
     }
 
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=train_dataset,
-    eval_dataset=eval_dataset,
-    compute_metrics=compute_metrics
-)
-
-trainer.train()
-
-trainer.save_model("./finetuned_model")
-tokenizer.save_pretrained("./finetuned_model")
-
-print("Модель сохранена в ./finetuned_model")
 
+def train(tokenizer, train_dataset, eval_dataset, num_labels, output_dir=OUTPUT_DIR,
+          model_name=MODEL_NAME, dataloader_num_workers=NUM_WORKERS):
+    """
+    Рецепт дообучения: Trainer с динамическим паддингом, группировкой по длине
+    и ранней остановкой по accuracy на eval_dataset; возвращает лучшую модель.
+    Используется и evaluate.py, чтобы фолды мерили ту же модель, что попадает на сервер.
+    """
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=num_labels)
+
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        evaluation_strategy="epoch",
+        save_strategy="epoch",
+        learning_rate=2e-5,
+        per_device_train_batch_size=16,
+        per_device_eval_batch_size=16,
+        num_train_epochs=MAX_EPOCHS,
+        weight_decay=0.01,
+        save_total_limit=2,
+        load_best_model_at_end=True,
+        metric_for_best_model="accuracy",
+        group_by_length=True,  # батчи из фраз близкой длины — меньше паддинга
+        dataloader_num_workers=dataloader_num_workers,
+    )
+
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer),
+        compute_metrics=compute_metrics,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=EARLY_STOPPING_PATIENCE)],
+    )
+    trainer.train()
+    return trainer.model
+
+
+def main():
+    # Загрузка данных
+    df = pd.read_csv(DATA_PATH)
+
+    # Преобразование меток в индексы
+    labels = list(df["label"].unique())
+    label2id = {l: i for i, l in enumerate(labels)}
+
+    df["label_id"] = df["label"].map(label2id)
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+
+    # Токенизированный датасет кэшируется на диске, пока не изменятся data.csv или токенизатор
+    cache_path = os.path.join(CACHE_DIR, cache_key(tokenizer, label2id))
+    if os.path.isdir(cache_path):
+        dataset = load_from_disk(cache_path)
+        print(f"Токенизированный датасет загружен из кэша {cache_path}")
+    else:
+        dataset = encode(Dataset.from_pandas(df), tokenizer)
+        # Сначала во временный каталог рядом, затем переименование: прерванный запуск
+        # не оставит недописанный кэш, которому поверит следующий
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        dataset.save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Параллельный запуск успел положить тот же кэш
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    dataset = as_model_inputs(dataset)
+
+    # Разбиваем на train и eval
+    split = dataset.train_test_split(test_size=0.2, seed=42)
+
+    model = train(tokenizer, split["train"], split["test"], len(labels))
+    model.save_pretrained(OUTPUT_DIR)
+    tokenizer.save_pretrained(OUTPUT_DIR)
+
+    print(f"Модель сохранена в {OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()